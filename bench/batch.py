@@ -0,0 +1,207 @@
+"""
+多数のゲームをシードと入力の方針を変えてウィンドウなしで実行し，結果を集計する
+各ゲームをProcessPoolExecutorで全コアに分散し，終わったものから1行1ゲームのJSONLに書き出し，
+最後に方針ごとの集計をJSONで出力する
+使い方：python bench/batch.py [--episodes N] [--seed S] [--policy 方針 ...] [--ticks N] [--workers N] [--out FILE] [--summary FILE]
+"""
+import argparse
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import random
+import sys
+import time
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import numpy as np
+import pygame as pg
+
+import musou_kokaton as game
+
+
+def policy_idle(seed: int):
+    """
+    何も操作しない
+    """
+    idle = game.Inputs()
+    return lambda state: idle
+
+
+def policy_random(seed: int):
+    """
+    ゲームとは別の乱数で，キーを押したり離したりし続ける
+    """
+    rnd = random.Random(seed)
+    held = set()
+
+    def policy(state: game.GameState) -> game.Inputs:
+        for key in game.INPUT_KEYS:
+            if rnd.random() < 0.1:
+                held.symmetric_difference_update({key})  # 押す／離すを切り替える
+        pressed = [key for key in game.INPUT_KEYS if rnd.random() < 0.05]
+        return game.Inputs(held, pressed)
+    return policy
+
+
+def policy_scripted(seed: int):
+    """
+    上下に往復しながらビームを撃ち続け，得点が貯まったら防御壁，重力場，無敵を使う
+    """
+    def policy(state: game.GameState) -> game.Inputs:
+        held = [pg.K_UP if state.tmr//40 % 2 else pg.K_DOWN]
+        pressed = [pg.K_SPACE] if state.tmr % 3 == 0 else []
+        if state.score.value >= 50 and not state.shields:
+            pressed.append(pg.K_v)
+        if state.score.value >= 300:
+            pressed.append(pg.K_RETURN)
+        if state.score.value >= 400 and state.bird.state == "normal":
+            held.append(pg.K_RSHIFT)
+        return game.Inputs(held, pressed)
+    return policy
+
+
+POLICIES = {  # 方針名→シードを受け取り入力を返す関数を作る関数
+    "idle": policy_idle,
+    "random": policy_random,
+    "scripted": policy_scripted,
+}
+
+
+def init_worker():
+    pg.init()
+    game.bake_assets()
+
+
+def run_episode(seed: int, policy: str, ticks: int) -> dict:
+    """
+    ゲームを1回実行して結果を返す
+    引数1 seed：乱数のシード
+    引数2 policy：入力の方針名
+    引数3 ticks：進める最大フレーム数
+    戻り値：結果の辞書
+    """
+    state = game.GameState(seed)
+    peaks = dict.fromkeys(state.groups, 0)
+    costs = []  # 実際に進めたフレームごとのstep()の時間[s]
+
+    def observe(state: game.GameState, seconds: float):
+        costs.append(seconds)
+        for group, n in state.counts().items():
+            if n > peaks[group]:
+                peaks[group] = n
+
+    game.run_headless(ticks, policy=POLICIES[policy](seed), state=state, observe=observe)
+    costs = np.array(costs)*1e6
+    return {
+        "seed": seed,
+        "policy": policy,
+        "ticks": state.tmr,
+        "over": state.over,
+        "score": state.score.value,
+        "level": state.level,
+        "life": state.bird.life,
+        "peak_entities": peaks,
+        "step_mean_us": float(costs.mean()),
+        "step_p99_us": float(np.percentile(costs, 99)),
+        "step_max_us": float(costs.max()),
+    }
+
+
+def describe(values: list[float]) -> dict[str, float]:
+    """
+    引数 values：値のリスト
+    戻り値：平均，標準偏差，最小，中央値，90パーセンタイル，最大の辞書
+    """
+    a = np.asarray(values, dtype=float)
+    return {
+        "mean": float(a.mean()),
+        "std": float(a.std()),
+        "min": float(a.min()),
+        "p50": float(np.percentile(a, 50)),
+        "p90": float(np.percentile(a, 90)),
+        "max": float(a.max()),
+    }
+
+
+def summarize(results: list[dict]) -> dict[str, dict]:
+    """
+    ゲームの結果を方針ごとに集計する
+    引数 results：run_episode()の結果のリスト
+    戻り値：方針名→集計結果の辞書
+    """
+    summary = {}
+    for policy in sorted({r["policy"] for r in results}):
+        rs = [r for r in results if r["policy"] == policy]
+        summary[policy] = {
+            "episodes": len(rs),
+            "game_over_rate": sum(r["over"] for r in rs)/len(rs),
+            "ticks": describe([r["ticks"] for r in rs]),
+            "score": describe([r["score"] for r in rs]),
+            "level": describe([r["level"] for r in rs]),
+            "step_mean_us": describe([r["step_mean_us"] for r in rs]),
+            "step_p99_us": describe([r["step_p99_us"] for r in rs]),
+            "peak_entities": {
+                group: describe([r["peak_entities"][group] for r in rs]) for group in rs[0]["peak_entities"]
+            },
+        }
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--episodes", type=int, default=100, help="方針ごとのゲーム数")
+    parser.add_argument("--seed", type=int, default=0, help="最初のゲームのシード（以降1ずつ増やす）")
+    parser.add_argument("--policy", nargs="*", default=["random"], help=f"入力の方針：{', '.join(POLICIES)}")
+    parser.add_argument("--ticks", type=int, default=5000, help="1ゲームの最大フレーム数")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="プロセス数")
+    parser.add_argument("--out", help="ゲームごとの結果を書き出すJSONLファイル（省略時は書き出さない）")
+    parser.add_argument("--summary", help="集計結果を書き出すJSONファイル（省略時は標準出力）")
+    args = parser.parse_args()
+    if args.ticks < 1:
+        parser.error("--ticksは1以上にしてください")
+    unknown = [name for name in args.policy if name not in POLICIES]
+    if unknown:
+        parser.error(f"不明な方針：{', '.join(unknown)}")
+
+    jobs = [(seed, policy) for policy in args.policy for seed in range(args.seed, args.seed+args.episodes)]
+    results = []
+    out = open(args.out, "w") if args.out else None
+    start = time.perf_counter()
+    ctx = multiprocessing.get_context("spawn")
+    try:
+        with concurrent.futures.ProcessPoolExecutor(args.workers, mp_context=ctx, initializer=init_worker) as pool:
+            futures = [pool.submit(run_episode, seed, policy, args.ticks) for seed, policy in jobs]
+            for i, future in enumerate(concurrent.futures.as_completed(futures), 1):
+                result = future.result()
+                results.append(result)
+                if out is not None:
+                    out.write(json.dumps(result)+"\n")
+                    out.flush()
+                print(f"\r{i}/{len(jobs)} episodes", end="", file=sys.stderr)
+    finally:
+        if out is not None:
+            out.close()
+    seconds = time.perf_counter()-start
+    ticks = sum(r["ticks"] for r in results)
+    print(f"\n{len(results)} episodes  {ticks} ticks in {seconds:.1f} s  ({ticks/seconds:.0f} ticks/sec)", file=sys.stderr)
+
+    report = {
+        "episodes": len(results),
+        "seconds": seconds,
+        "ticks_per_sec": ticks/seconds,
+        "policies": summarize(results),
+    }
+    text = json.dumps(report, indent=2)
+    if args.summary:
+        with open(args.summary, "w") as f:
+            f.write(text+"\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+SpatialHashとpg.sprite.groupcollideの衝突判定の速さを比べるベンチマーク
+使い方：python bench/bench_collision.py [エンティティ数 ...]
+"""
+import os
+import random
+import sys
+import time
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import pygame as pg
+
+from musou_kokaton import HEIGHT, WIDTH, SpatialHash
+
+
+def make_group(n: int, size: tuple[int, int], rnd: random.Random) -> pg.sprite.Group:
+    """
+    画面内にランダムに配置したn個のスプライトのグループを作る
+    引数1 n：スプライトの数
+    引数2 size：一辺の長さの最小値と最大値
+    引数3 rnd：乱数生成器
+    戻り値：グループ
+    """
+    group = pg.sprite.Group()
+    for _ in range(n):
+        sprite = pg.sprite.Sprite()
+        w, h = rnd.randint(*size), rnd.randint(*size)
+        sprite.rect = pg.Rect(rnd.randint(0, WIDTH-w), rnd.randint(0, HEIGHT-h), w, h)
+        group.add(sprite)
+    return group
+
+
+def run(n: int, seed: int = 0) -> tuple[float, float]:
+    """
+    n個の爆弾とn/10個のビームの衝突判定を両方の方法で行い，結果が同じことを確かめる
+    引数1 n：爆弾の数
+    引数2 seed：乱数のシード
+    戻り値：groupcollideとSpatialHashそれぞれの所要時間[ms]
+    """
+    rnd = random.Random(seed)
+    bombs = make_group(n, (8, 32), rnd)
+    beams = make_group(max(1, n//10), (8, 32), rnd)
+
+    t0 = time.perf_counter()
+    expected = pg.sprite.groupcollide(bombs, beams, False, False)
+    t1 = time.perf_counter()
+    grid = SpatialHash()
+    grid.build([beams])
+    actual = grid.groupcollide(bombs, beams, False, False)
+    t2 = time.perf_counter()
+    assert actual == expected, "SpatialHashの結果がgroupcollideと一致しない"
+    return (t1-t0)*1000, (t2-t1)*1000
+
+
+def main():
+    counts = [int(arg) for arg in sys.argv[1:]] or [1000, 2000, 5000, 10000]
+    print(f"{'n':>6} {'groupcollide[ms]':>17} {'SpatialHash[ms]':>16} {'speedup':>8}")
+    for n in counts:
+        naive, grid = run(n)
+        print(f"{n:>6} {naive:>17.2f} {grid:>16.2f} {naive/grid:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
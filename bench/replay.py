@@ -0,0 +1,52 @@
+"""
+記録したリプレイをウィンドウなしで実時間に合わせずに再生し，結果と速さを出力する
+記録時のスコアとゲームオーバーのフレームが再現されなければ終了コード1で終わる
+使い方：python bench/replay.py リプレイファイル [--repeat N] [--profile]
+リプレイはmusou_kokaton.pyのREPLAY_LOGにファイルパスを指定してプレイすると記録される
+"""
+import argparse
+import os
+import sys
+import time
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import pygame as pg
+
+import musou_kokaton as game
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("log", help="リプレイファイル")
+    parser.add_argument("--repeat", type=int, default=1, help="再生する回数")
+    parser.add_argument("--profile", action="store_true", help="処理段階ごとの時間も出力する")
+    args = parser.parse_args()
+
+    log = game.InputLog.load(args.log)
+    pg.init()
+    pg.display.set_mode((game.WIDTH, game.HEIGHT))
+    game.bake_assets()
+    print(f"seed {log.seed}  {len(log)} ticks  recorded score {log.score}  over {log.over}")
+
+    ok = True
+    for i in range(args.repeat):
+        prof = game.FrameProfiler(size=len(log)) if args.profile else None
+        start = time.perf_counter()
+        state = game.run_replay(log, prof)
+        seconds = time.perf_counter()-start
+        tick = len(log)-1 if log.over else len(log)  # ゲームオーバーになったフレームは数えない
+        match = (state.score.value, state.over, state.tmr) == (log.score, log.over, tick)
+        ok = ok and match
+        print(f"run {i+1}: tick {state.tmr}  score {state.score.value}  over {state.over}  "
+              f"{state.tmr/seconds:.0f} ticks/sec  {'OK' if match else 'MISMATCH'}")
+        if prof is not None:
+            for name, (p50, p99) in prof.summary().items():
+                print(f"  {name:<18} p50 {p50:8.1f} us  p99 {p99:8.1f} us")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
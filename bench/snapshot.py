@@ -0,0 +1,123 @@
+"""
+大量のエンティティをばらまいた直後にスナップショットの撮影・復元の時間を計り，進めながら巻き戻し用の記録
+（Rewind.push()）の時間をその時のエンティティ数ごとに計って，途中から同じ入力で進め直して元と全く同じ状態になるかを確かめる
+同じにならなければ終了コード1で終わる
+ばらまいた数のまま計測するため，LIFECYCLE_RULESの最大数による追い出しは外して動かす
+使い方：python bench/snapshot.py [--bombs N] [--bullets N] [--ticks N] [--seed S]
+"""
+import argparse
+import os
+import sys
+import time
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import numpy as np
+import pygame as pg
+
+import musou_kokaton as game
+
+
+def setup(state: game.GameState, bombs: int, bullets: int):
+    """
+    画面内に爆弾と弾をばらまき，敵を並べる（こうかとんは最後まで無敵にしておく）
+    """
+    state.bird.state = "hyper"
+    state.bird.hyper_life = 10**9
+    for _ in range(bombs):
+        emy = pg.sprite.Sprite()
+        emy.rect = pg.Rect(0, 0, 40, 40)
+        emy.rect.center = state.rng.randint(60, game.WIDTH-60), state.rng.randint(60, game.HEIGHT-60)
+        game.Bomb.spawn(state.bombs, emy, state.bird, state.score, state.rng)
+    ring = game.BulletPattern("ring", n=50, speed=2)
+    origins = [(x, game.HEIGHT//2) for x in range(100, game.WIDTH-100, (game.WIDTH-200)//10)][:10]
+    for _ in range(bullets//(50*len(origins))):
+        ring.fire(origins, state.bullets, state.bird, state.rng)
+    for _ in range(30):
+        state.emys.add(game.Enemy(state.rng))
+    for _ in range(3):
+        state.emy2s.add(game.Enemy2(state.rng))
+    state.boss.add(game.BOSS(state.rng))
+
+
+def inputs(tick: int) -> game.Inputs:
+    """
+    上下に往復しながらビームを撃ち続ける
+    """
+    held = [pg.K_UP if tick//40 % 2 else pg.K_DOWN]
+    return game.Inputs(held, [pg.K_SPACE] if tick % 3 == 0 else [])
+
+
+def entities(state: game.GameState) -> int:
+    return sum(state.counts().values())
+
+
+def percentiles(seconds: list[float]) -> str:
+    us = np.array(seconds)*1e6
+    return f"p50 {np.percentile(us, 50):7.1f} us  p99 {np.percentile(us, 99):7.1f} us"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--bombs", type=int, default=2000, help="最初にばらまく爆弾の数")
+    parser.add_argument("--bullets", type=int, default=2000, help="最初にばらまく弾の数")
+    parser.add_argument("--ticks", type=int, default=300, help="進めるフレーム数")
+    parser.add_argument("--seed", type=int, default=0, help="乱数のシード")
+    args = parser.parse_args()
+
+    pg.init()
+    game.bake_assets()
+    rules = game.Lifecycle.uncapped()
+    state = game.GameState(args.seed, lifecycle=rules)
+    setup(state, args.bombs, args.bullets)
+    clock = time.perf_counter
+    capture, restore = [], []
+    for _ in range(200):
+        start = clock()
+        data = state.snapshot()
+        capture.append(clock()-start)
+        start = clock()
+        state.restore(data)
+        restore.append(clock()-start)
+    print(f"tick {state.tmr}  {entities(state)} entities  snapshot {len(data)} bytes")
+    print(f"snapshot  {percentiles(capture)}")
+    print(f"restore   {percentiles(restore)}")
+
+    rewind = game.Rewind(args.ticks)
+    push: dict[int, list[float]] = {}  # エンティティ数（1000単位）→そのときのpush()の時間
+    for tick in range(args.ticks):
+        tick_inputs = inputs(tick)
+        bucket = entities(state)//1000*1000
+        start = clock()
+        rewind.push(state, tick_inputs)
+        push.setdefault(bucket, []).append(clock()-start)
+        state.step(tick_inputs)
+        if state.over:
+            break
+    counts = {name: n for name, n in state.counts().items() if n}
+    final = state.snapshot()
+    nbytes = sum(len(data) for tmr, data in rewind.keys)+len(rewind.inputs)*game.Rewind.INPUT.itemsize
+    print(f"tick {state.tmr}  {counts}")
+    for bucket, seconds in sorted(push.items(), reverse=True):
+        print(f"push {bucket:5d}+ entities  {percentiles(seconds)}  ({len(seconds)} frames)")
+    print(f"rewind    {len(rewind)} frames in {len(rewind.keys)} keyframes, {nbytes/1e6:.2f} MB")
+
+    # 途中から進め直して元の最後の状態と比べる
+    ok = True
+    for tmr in (rewind.first(), (rewind.first()+rewind.last())//2, rewind.last()-1):
+        resumed = game.GameState(args.seed+1, lifecycle=rules)
+        start = clock()
+        tmr = rewind.restore(resumed, tmr)
+        seconds = clock()-start
+        while resumed.tmr < state.tmr and not resumed.over:
+            resumed.step(inputs(resumed.tmr))
+        match = resumed.snapshot() == final
+        ok = ok and match
+        print(f"resume from tick {tmr} (restored in {seconds*1e3:.1f} ms): {'OK' if match else 'MISMATCH'}")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,238 @@
+"""
+負荷の高い場面を再現して1フレームあたりの処理時間を計測するベンチマーク
+各シナリオを固定シードで決まったフレーム数だけウィンドウなしで動かし，
+FPS，処理段階ごとの時間，最大RSS，確保中のメモリブロック数の増減，発火・予約中のイベント数，
+スプライトのプールと画像キャッシュの統計をJSONで出力する
+シナリオで並べた数のまま計測するため，LIFECYCLE_RULESの最大数による追い出しは外して動かす
+使い方：python bench/stress.py [シナリオ名 ...] [--ticks N] [--seed S] [--no-draw] [--per-group] [--out FILE]
+"""
+import argparse
+import concurrent.futures
+import gc
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import numpy as np
+import pygame as pg
+
+import musou_kokaton as game
+
+
+def emitter(x: int, y: int) -> pg.sprite.Sprite:
+    """
+    爆弾や爆発の発生源として使う，位置だけを持つスプライトを作る
+    """
+    sprite = pg.sprite.Sprite()
+    sprite.rect = pg.Rect(0, 0, 40, 40)
+    sprite.rect.center = x, y
+    return sprite
+
+
+def random_point(state: game.GameState, margin: int = 60) -> tuple[int, int]:
+    return state.rng.randint(margin, game.WIDTH-margin), state.rng.randint(margin, game.HEIGHT-margin)
+
+
+def setup_enemy2_rings(state: game.GameState):
+    """
+    画面上部に並んだ敵2が一斉に全周弾を撃ち続ける
+    """
+    for i in range(20):
+        emy2 = game.Enemy2(state.rng)
+        emy2.rect.center = (i+1)*game.WIDTH//21, game.HEIGHT//6
+        emy2.vy = 0
+        emy2.state = "move"
+        state.emy2s.add(emy2)
+
+
+RING24 = game.BulletPattern("ring", n=24, speed=4)
+
+
+def tick_enemy2_rings(state: game.GameState):
+    if state.tmr % 10 == 0:
+        RING24.fire([emy2.rect.center for emy2 in state.emy2s], state.bullets, state.bird, state.rng)
+
+
+def setup_bombs(state: game.GameState):
+    """
+    画面内を跳ね回る大量の爆弾
+    """
+    for _ in range(2000):
+        game.Bomb.spawn(state.bombs, emitter(*random_point(state)), state.bird, state.score, state.rng)
+
+
+def setup_neobeam(state: game.GameState):
+    """
+    強化状態の7-wayビームを毎フレーム撃ち続け，降りてくる敵を撃ち落とす
+    """
+    state.btime = 10**9
+    for _ in range(50):
+        state.emys.add(game.Enemy(state.rng))
+
+
+def inputs_neobeam(state: game.GameState) -> game.Inputs:
+    dire = pg.K_LEFT if state.tmr % 100 < 50 else pg.K_UP
+    return game.Inputs((pg.K_LSHIFT, dire), (pg.K_SPACE,))
+
+
+def tick_explosions(state: game.GameState):
+    """
+    毎フレーム20個の爆発を発生させる
+    """
+    for _ in range(20):
+        state.explode(emitter(*random_point(state)), 100)
+
+
+def setup_gravity(state: game.GameState):
+    """
+    画面全体の重力場の中に敵，爆弾，弾を流し込み続ける
+    """
+    state.gravitys.add(game.Gravity(10**9))
+
+
+def tick_gravity(state: game.GameState):
+    for _ in range(5):
+        state.emys.add(game.Enemy(state.rng))
+        game.Bomb.spawn(state.bombs, emitter(*random_point(state)), state.bird, state.score, state.rng)
+    state.bullets.emit(random_point(state), np.arange(0, 360, 15), 4)
+
+
+SCENARIOS = {  # シナリオ名→(初期化，毎フレームの処理，入力)
+    "enemy2_rings": (setup_enemy2_rings, tick_enemy2_rings, None),
+    "bombs": (setup_bombs, None, None),
+    "neobeam": (setup_neobeam, None, inputs_neobeam),
+    "explosions": (None, tick_explosions, None),
+    "gravity": (setup_gravity, tick_gravity, None),
+}
+
+
+def run_scenario(name: str, ticks: int, seed: int, draw: bool, batched: bool = True) -> dict:
+    """
+    シナリオを1つ実行して計測結果を返す
+    引数1 name：シナリオ名
+    引数2 ticks：進めるフレーム数
+    引数3 seed：乱数のシード
+    引数4 draw：オフスクリーンへの描画も行うかどうか
+    引数5 batched：まとめて描画するか（Falseならグループごとに描画する）
+    戻り値：計測結果の辞書
+    """
+    pg.init()
+    screen = pg.display.set_mode((game.WIDTH, game.HEIGHT))
+    game.bake_assets()
+    setup, tick, policy = SCENARIOS[name]
+    prof = game.FrameProfiler(size=ticks)
+    state = game.GameState(seed, profiler=prof, lifecycle=game.Lifecycle.uncapped())
+    state.bird.life = 10**9  # 計測中にゲームオーバーにならないようにする
+    state.batched = batched
+    if setup is not None:
+        setup(state)
+    idle = game.Inputs()
+    peaks = dict.fromkeys(state.groups, 0)
+
+    def inputs(state: game.GameState) -> game.Inputs:
+        prof.begin()
+        if tick is not None:
+            tick(state)
+        prof.lap("scenario")
+        return policy(state) if policy is not None else idle
+
+    def observe(state: game.GameState, seconds: float):
+        if draw:
+            state.draw(screen, doreturn=False)
+        counts = state.counts()
+        prof.end_frame(counts)
+        for group, n in counts.items():
+            peaks[group] = max(peaks[group], n)
+
+    gc.collect()
+    gc_before = [s["collections"] for s in gc.get_stats()]
+    blocks_before = sys.getallocatedblocks()
+
+    start = time.perf_counter()
+    game.run_headless(ticks, policy=inputs, state=state, observe=observe)
+    seconds = time.perf_counter()-start
+
+    phases = {
+        name: {"p50_us": p50, "p99_us": p99, "mean_us": float(np.mean(prof.samples[name]))/1000}
+        for name, (p50, p99) in prof.summary().items()
+    }
+    return {
+        "scenario": name,
+        "ticks": ticks,
+        "seed": seed,
+        "draw": draw,
+        "batched": batched,
+        "seconds": seconds,
+        "fps": ticks/seconds,
+        "phases": phases,
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "net_allocated_blocks": sys.getallocatedblocks()-blocks_before,  # 確保中のブロック数の増減（途中で解放された分は含まない）
+        "gc_collections": [s["collections"]-b for s, b in zip(gc.get_stats(), gc_before)],
+        "peak_entities": peaks,
+        "timers_fired": state.sched.fired,  # 発火したイベントの総数
+        "timers_pending": state.sched.pending(),  # 最後に予約中だったイベントの数
+        "pools": {name: pool.stats() for name, pool in game.POOLS.items()},  # クラス名→スプライトのプールの統計
+        "assets": game.ASSETS.stats(),  # 画像キャッシュのヒット・ミス数など
+    }
+
+
+def git_commit() -> str | None:
+    """
+    戻り値：計測したコミットのハッシュ（取得できなければNone）
+    """
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("scenarios", nargs="*", help=f"実行するシナリオ（省略時はすべて）：{', '.join(SCENARIOS)}")
+    parser.add_argument("--ticks", type=int, default=500, help="各シナリオのフレーム数")
+    parser.add_argument("--seed", type=int, default=0, help="乱数のシード")
+    parser.add_argument("--no-draw", action="store_true", help="描画を行わずロジックだけを計測する")
+    parser.add_argument("--per-group", action="store_true", help="まとめて描画せずグループごとに描画する")
+    parser.add_argument("--out", help="結果を書き出すJSONファイル（省略時は標準出力）")
+    args = parser.parse_args()
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"不明なシナリオ：{', '.join(unknown)}")
+
+    results = []
+    ctx = multiprocessing.get_context("spawn")  # 最大RSSをシナリオごとに測るため別プロセスで実行する
+    for name in args.scenarios or SCENARIOS:
+        with concurrent.futures.ProcessPoolExecutor(1, mp_context=ctx) as pool:
+            result = pool.submit(run_scenario, name, args.ticks, args.seed, not args.no_draw, not args.per_group).result()
+        print(f"{name:<14} {result['fps']:>9.1f} fps  peak RSS {result['peak_rss_kb']//1024} MB", file=sys.stderr)
+        results.append(result)
+
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "pygame": pg.version.ver,
+        "numpy": np.__version__,
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text+"\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,78 @@
+import csv
+import json
 import math
+import mmap
 import os
 import random
+import struct
 import sys
 import time
+import warnings
+import zlib
+from collections import OrderedDict, deque
+import numpy as np
 import pygame as pg
 
 WIDTH, HEIGHT = 1000, 600  # ゲームウィンドウの幅，高さ
-os.chdir(os.path.dirname(os.path.abspath(__file__)))
+ASSET_CACHE_SIZE = 512  # 変形済み画像キャッシュの最大保持数
+ASSET_BUNDLE = "fig.bundle"  # 画像をまとめたファイル（python musou_kokaton.py --bake で作る．なければfig/から読み込む）
+BUNDLE_SOURCE_LIMIT = 8 << 20  # これより大きい元画像はまとめない[バイト]（縮小済みの画像だけをまとめる）
+ATLAS_STEPS = 72  # 回転アトラスの角度分割数（大きいほど滑らかだがメモリを使う，0で無効）
+GRID_CELL = 64  # 衝突判定用グリッドの1マスの大きさ
+DIRTY_RENDERING = False  # Trueなら変化した部分だけを描き直して表示する
+DIRTY_THRESHOLD = 0.5  # 変化した面積が画面のこの割合を超えたら全体を描き直す
+BATCHED_DRAW = True  # Trueなら全グループの描画をまとめ，レイヤーごとに1回のblitsで描画する
+DRAW_LAYERS = {  # 描画対象→レイヤー番号（小さいほど奥に描く．同じレイヤーの中は画像ごとにまとめる）
+    "bird": 0, "beams": 1, "emys": 2, "boss": 3, "emy2s": 4, "bullets": 5, "bombs": 6,
+    "shields": 7, "particles": 8, "spanners": 9, "doubles": 10, "hud": 11,
+}
+OVERLAYS = {  # 名前→(色，最大の不透明度，現れるまでのフレーム数，消えるまでのフレーム数)（上から順に重ねる）
+    "gravity": ((0, 0, 0), 128, 5, 5),  # 重力場で画面を暗くする
+    "hyper": ((255, 255, 0), 32, 10, 25),  # 無敵状態の間，画面を黄色がからせる
+    "damage": ((255, 0, 0), 64, 0, 10),  # 被弾したときに画面を赤く光らせる
+}
+HUD_DEBUG = False  # Trueならスコアと体力に加えて，強化ビームの残り回数，レベル，FPSも表示する
+PROFILE_KEY = pg.K_F3  # 計測結果のオーバーレイ表示を切り替えるキー
+PROFILE_FRAMES = 300  # 計測結果を保持するフレーム数
+PROFILE_CSV = None  # ファイルパスを指定するとフレームごとの計測結果をCSVに書き出す
+LIFECYCLE_RULES = {  # グループ名→寿命の規則（ttl：生存フレーム数，offscreen：画面外に出たら消す，
+                     # idle/idle_ttl：idleが真になってから消すまでのフレーム数，cap：最大数，evict：超えたとき消す側）
+                     # Worldの種類では，idleはTableを受け取りエンティティごとの真偽の配列を返す
+    "bombs": {"ttl": 1500, "idle": lambda bombs: ~bombs["active"], "idle_ttl": 250, "cap": 400},
+    "emys": {"idle": lambda emy: emy.interval == math.inf, "idle_ttl": 250, "cap": 200},
+    "spanners": {"offscreen": True, "cap": 50},
+    "doubles": {"offscreen": True, "cap": 50},
+}
+LEAK_SAMPLE = 50  # エンティティ数を記録する間隔[フレーム]
+LEAK_WINDOW = 40  # 増加傾向の判定に使う記録の数
+LEAK_SLOPE = 20.0  # 1000フレームあたりこの数以上増え続けるグループを警告する（半分を下回ったら解除）
+INPUT_KEYS = (  # ゲームが参照するキー
+    pg.K_UP, pg.K_DOWN, pg.K_LEFT, pg.K_RIGHT,
+    pg.K_LSHIFT, pg.K_RSHIFT, pg.K_SPACE, pg.K_e, pg.K_v, pg.K_RETURN,
+)
+SIM_HZ = 50  # ゲームの進行を1秒あたり何回行うか（描画の速さに関係なく一定）
+RENDER_FPS = 120  # 描画の上限FPS（0なら上限なし．進行の間は位置を補間して描く）
+MAX_FRAMESKIP = 10  # 処理が遅れたとき，描画を省いて続けて進める最大回数（それ以上の遅れは諦める）
+QUALITY_GOVERNOR = True  # Trueなら処理が重いときに描画品質を段階的に下げる
+QUALITY_BUDGET = 20.0  # 1フレームの処理時間の目標[ms]（50FPS）
+QUALITY_WINDOW = 25  # 処理時間の移動平均をとるフレーム数（品質を変えたあとはこの間変えない）
+QUALITY_RESTORE = 0.6  # 移動平均が目標のこの割合を下回ったら品質を1段階戻す
+QUALITY_STEPS = (  # 品質の段階（下ほど軽い）：particle_cap：パーティクルの最大数，particle_life：パーティクルの寿命の倍率，
+                   # bullet_steps：新しい弾の向きの数，skip：描画しない描画対象とOverlayの名前
+    {},
+    {"particle_cap": 200, "particle_life": 0.5},
+    {"particle_cap": 100, "particle_life": 0.5, "bullet_steps": 24},
+    {"particle_cap": 100, "particle_life": 0.5, "bullet_steps": 24, "skip": ("particles", "hyper")},
+)
+REPLAY_LOG = None  # ファイルパスを指定するとプレイの入力をリプレイとして書き出す
+PARTICLE_CAPACITY = 512  # 同時に存在できるパーティクルの最大数（配列は起動時にこの大きさで確保して使い回す）
+PARTICLE_BUDGET = 256  # 1フレームに新しく出せるパーティクルの最大数（超えた分は出さない）
+REWIND_FRAMES = 500  # 巻き戻せるようにしておくフレーム数（0なら記録しない）
+REWIND_KEYFRAME = SIM_HZ  # 完全なスナップショットを撮る間隔[フレーム]（間のフレームは入力だけを持ち，戻すときに進め直す）
+REWIND_KEY = pg.K_BACKSPACE  # 押すとREWIND_STEPフレーム前の状態に巻き戻すキー
+REWIND_STEP = 2*SIM_HZ  # REWIND_KEYで巻き戻すフレーム数
+CRASH_DUMP = "crash.mkrw"  # 例外で止まったときに巻き戻し用のスナップショットを書き出すファイル（ROOTからの相対パス．Noneなら書き出さない）
+ROOT = os.path.dirname(os.path.abspath(__file__))  # 画像のパスの基準になるディレクトリ
 
 def check_bound(obj_rct:pg.Rect) -> tuple[bool, bool]:
     """
@@ -34,6 +100,565 @@ def calc_orientation(org: pg.Rect, dst: pg.Rect) -> tuple[float, float]:
     return x_diff/norm, y_diff/norm
 
 
+def intercept(origin, target, velocity, speed) -> np.ndarray:
+    """
+    等速で動く標的に，originから速さspeedで撃った弾が当たる位置を閉じた式でまとめて求める
+    標的までの差d，標的の速度v，弾の速さsについて |d+vt| = st の最小の正の解tを使う
+    解がない（弾が標的より遅く追いつけない）ときは標的の現在位置を返す
+    引数1 origin：発射位置の配列（(k, 2)または(2,)）
+    引数2 target：標的の現在位置
+    引数3 velocity：標的の1フレームあたりの速度ベクトル
+    引数4 speed：弾の速さ（スカラーまたは長さkの配列）
+    戻り値：当たる位置の配列（(k, 2)）
+    """
+    target = np.asarray(target, dtype=float)
+    d = target-np.atleast_2d(np.asarray(origin, dtype=float))
+    v = np.asarray(velocity, dtype=float)
+    s = np.asarray(speed, dtype=float)
+    a = v@v-s*s
+    b = 2*(d@v)
+    c = np.einsum("ij,ij->i", d, d)
+    disc = b*b-4*a*c
+    with np.errstate(divide="ignore", invalid="ignore"):
+        root = np.sqrt(np.maximum(disc, 0.0))
+        t1, t2 = (-b-root)/(2*a), (-b+root)/(2*a)
+        t = np.where((t1 > 0) & ((t1 < t2) | (t2 <= 0)), t1, t2)
+        t = np.where(np.abs(a) < 1e-9, -c/b, t)  # 弾と標的が同じ速さなら1次方程式
+    t = np.where((disc >= 0) & np.isfinite(t) & (t > 0), t, 0.0)
+    return target+v*t[:, None]
+
+
+def circles_hit_rect(pos: np.ndarray, radius: np.ndarray, rect: pg.Rect) -> np.ndarray:
+    """
+    複数の円とRectが重なっているかをまとめて判定する
+    引数1 pos：円の中心座標の配列
+    引数2 radius：円の半径の配列
+    引数3 rect：Rect
+    戻り値：重なっている円ではTrueとなる配列
+    """
+    dx = pos[:, 0]-np.clip(pos[:, 0], rect.left, rect.right)  # Rect内で円の中心に最も近い点までの距離
+    dy = pos[:, 1]-np.clip(pos[:, 1], rect.top, rect.bottom)
+    return dx*dx+dy*dy < radius*radius
+
+
+def effect_hyper(img: pg.Surface) -> pg.Surface:
+    """
+    無敵状態の見た目（輪郭抽出）の画像を生成する
+    引数 img：元の画像Surface
+    戻り値：加工した画像Surface
+    """
+    return pg.transform.laplacian(img)
+
+
+def effect_emp(img: pg.Surface) -> pg.Surface:
+    """
+    EMPを受けた敵機の見た目（輪郭抽出して黒を透過）の画像を生成する
+    引数 img：元の画像Surface
+    戻り値：加工した画像Surface
+    """
+    img = pg.transform.laplacian(img)
+    img.set_colorkey((0, 0, 0))
+    return img
+
+
+def effect_damaged(img: pg.Surface) -> pg.Surface:
+    """
+    被弾したときの見た目（赤みがかった色）の画像を生成する
+    引数 img：元の画像Surface
+    戻り値：加工した画像Surface
+    """
+    img = img.copy()
+    img.fill((255, 96, 96), special_flags=pg.BLEND_RGB_MULT)
+    return img
+
+
+EFFECTS = {  # 効果名→元画像から加工した画像を生成する関数（ここに追加すれば新しい効果を使える）
+    "hyper": effect_hyper,
+    "emp": effect_emp,
+    "damaged": effect_damaged,
+}
+
+
+def flipbook_explosion() -> list[pg.Surface]:
+    """
+    戻り値：爆発のコマ画像のリスト（元画像と上下左右反転した画像を交互に表示する）
+    """
+    return [ASSETS.get("fig/explosion.gif"), ASSETS.get("fig/explosion.gif", flip=(True, True))]
+
+
+def flipbook_spark() -> list[pg.Surface]:
+    """
+    戻り値：火花のコマ画像のリスト（消える直前のものから順に，小さく暗い）
+    """
+    frames = []
+    for i in range(4):
+        r = i+1
+        img = pg.Surface((2*r, 2*r), pg.SRCALPHA)
+        pg.draw.circle(img, (255, 200+15*i, 64*i, 96+53*i), (r, r), r)
+        frames.append(img)
+    return frames
+
+
+def flipbook_debris() -> list[pg.Surface]:
+    """
+    戻り値：破片のコマ画像のリスト（回転しながら落ちる）
+    """
+    img = pg.Surface((6, 6), pg.SRCALPHA)
+    img.fill((128, 128, 128))
+    return [pg.transform.rotate(img, angle) for angle in (0, 22.5, 45, 67.5)]
+
+
+def flipbook_pickup() -> list[pg.Surface]:
+    """
+    戻り値：アイテム取得の輪のコマ画像のリスト（消える直前のものから順に，大きく薄い）
+    """
+    frames = []
+    for i in range(5):
+        r = 24-4*i
+        img = pg.Surface((2*r, 2*r), pg.SRCALPHA)
+        pg.draw.circle(img, (255, 255, 128, 60+45*i), (r, r), r, 2)
+        frames.append(img)
+    return frames
+
+
+PARTICLES = {  # 種類名→パーティクルの設定（frames：消える直前から順のコマ画像のリストを返す関数，life：寿命[フレーム]，
+               # speed：飛び散る速さの範囲，gravity：下向きの加速度，period：1コマを表示するフレーム数）
+    "explosion": {"frames": flipbook_explosion, "life": 50, "speed": (0, 0), "gravity": 0.0, "period": 10},
+    "spark": {"frames": flipbook_spark, "life": 12, "speed": (3, 8), "gravity": 0.0, "period": 3},
+    "debris": {"frames": flipbook_debris, "life": 30, "speed": (1, 5), "gravity": 0.3, "period": 4},
+    "pickup": {"frames": flipbook_pickup, "life": 20, "speed": (0, 0), "gravity": 0.0, "period": 4},
+}
+BULLET_PATTERNS = {  # パターン名→弾幕の設定（shape：ring/fan/aimed/predict/spiral/spray，n：1回に撃つ弾の数，
+                     # speed：弾の速さ（(最小, 最大)なら撃つたびに整数の乱数），spread：扇の広がり[度]，turn：渦巻きが1回ごとに回る角度[度]）
+    "ring": {"shape": "ring", "n": 12, "speed": (4, 7)},
+    "aim": {"shape": "aimed", "speed": 6.0},
+    "predict": {"shape": "predict", "speed": 16},
+    "spray": {"shape": "spray", "speed": 5},
+    "fan": {"shape": "fan", "n": 5, "spread": 60, "speed": 5},
+    "spiral": {"shape": "spiral", "n": 3, "turn": 23, "speed": 3},
+}
+
+
+class Assets:
+    """
+    画像ファイルの読み込みと変形結果をキャッシュするクラス
+    元画像はファイルごとに1度だけ読み込み，画面のピクセル形式に変換して保持する
+    回転・拡大・反転した画像は(パス，角度，倍率，反転，効果，なめらかに拡大縮小したか)をキーとしてLRUで保持する
+    バンドルを開いていれば，そこに含まれる画像はデコードや変形をせずにピクセルデータから作る
+    """
+    BUNDLE_HEADER = struct.Struct("<4sII")  # 識別子，版，目次のバイト数
+    BUNDLE_MAGIC = b"MKAB"
+    BUNDLE_VERSION = 1
+
+    def __init__(self, maxsize: int = ASSET_CACHE_SIZE):
+        """
+        引数 maxsize：変形済み画像の最大保持数
+        """
+        self.maxsize = maxsize
+        self.images: dict[str, pg.Surface] = {}  # パス→変換済みの元画像
+        self.variants: OrderedDict = OrderedDict()  # キー→変形済み画像（LRU順）
+        self.atlases: dict[str, "RotationAtlas"] = {}  # パス→回転アトラス
+        self.bundle: mmap.mmap | None = None  # メモリマップしたバンドル
+        self.bundled: dict[str, dict] = {}  # bundle_key()→バンドル内の画像の情報
+        self.bundle_base = 0  # バンドル内のピクセルデータの先頭の位置
+        self.hits = 0
+        self.misses = 0
+        self.bundle_loads = 0  # バンドルから作った画像の数
+
+    def load(self, path: str) -> pg.Surface:
+        """
+        元画像Surfaceを返す（初回のみバンドルまたはファイルから読み込む）
+        画面が生成済みなら，透過情報を持つ画像はconvert_alpha()，それ以外はconvert()で変換する
+        引数 path：画像ファイルのパス
+        戻り値：元画像Surface
+        """
+        img = self.images.get(path)
+        if img is not None:
+            return img
+        img = self.from_bundle(self.bundle_key(path))
+        if img is None:
+            img = pg.image.load(os.path.join(ROOT, path))
+            if pg.display.get_surface() is not None:
+                if img.get_flags() & pg.SRCALPHA or img.get_colorkey() is not None:
+                    img = img.convert_alpha()
+                else:
+                    img = img.convert()
+        self.images[path] = img
+        return img
+
+    def get(self, path: str, angle: float = 0, scale: float = 1.0,
+            flip: tuple[bool, bool] = (False, False), effect: str | None = None, smooth: bool = True) -> pg.Surface:
+        """
+        変形済み画像Surfaceを返す
+        引数1 path：画像ファイルのパス
+        引数2 angle：回転角度(度数法)
+        引数3 scale：拡大率
+        引数4 flip：(左右反転，上下反転)
+        引数5 effect：EFFECTSに登録された効果名（Noneなら効果なし）
+        引数6 smooth：Falseなら回転せずにpg.transform.scaleで拡大縮小する（幅・高さは小数点以下を切り捨てる）
+        戻り値：変形済み画像Surface（共有されるため書き換えないこと）
+        """
+        if angle == 0 and scale == 1.0 and flip == (False, False) and effect is None:
+            return self.load(path)
+        key = (path, angle, scale, flip, effect, smooth)
+        img = self.variants.get(key)
+        if img is not None:
+            self.hits += 1
+            self.variants.move_to_end(key)
+            return img
+        self.misses += 1
+        img = self.from_bundle(self.bundle_key(path, angle, scale, flip, effect, smooth))
+        if img is None and effect is not None:
+            img = EFFECTS[effect](self.get(path, angle, scale, flip, smooth=smooth))  # 変形済みの画像に効果をかける
+        elif img is None:
+            img = self.load(path)
+            if flip != (False, False):
+                img = pg.transform.flip(img, *flip)
+            if not smooth:
+                img = pg.transform.scale(img, (img.get_width()*scale, img.get_height()*scale))
+            elif angle != 0 or scale != 1.0:
+                img = pg.transform.rotozoom(img, angle, scale)
+        self.variants[key] = img
+        if len(self.variants) > self.maxsize:
+            self.variants.popitem(last=False)  # 最も古く使われた画像を捨てる
+        return img
+
+    def bake_atlas(self, path: str, scales: tuple[float, ...], steps: int = ATLAS_STEPS):
+        """
+        回転アトラスを事前生成して登録する（steps が0以下なら何もしない）
+        引数1 path：画像ファイルのパス
+        引数2 scales：生成する拡大率のタプル
+        引数3 steps：1周の角度分割数
+        """
+        if steps > 0:
+            atlas = RotationAtlas(
+                self.load(path), scales, steps,
+                lambda angle, scale: self.from_bundle(self.bundle_key(path, angle, scale)),
+            )
+            if self.bundle is None:
+                atlas.fill()  # バンドルがなければ起動時に回転しておく（あれば使うときに取り出す）
+            self.atlases[path] = atlas
+
+    def rotated(self, path: str, angle: float, scale: float = 1.0) -> pg.Surface:
+        """
+        回転済み画像Surfaceを返す
+        アトラスが生成済みならその中から引き，なければget()で生成する
+        引数1 path：画像ファイルのパス
+        引数2 angle：回転角度(度数法)
+        引数3 scale：拡大率
+        戻り値：回転済み画像Surface
+        """
+        atlas = self.atlases.get(path)
+        if atlas is not None and scale in atlas.frames:
+            return atlas.image(angle, scale)
+        return self.get(path, angle, scale)
+
+    def stats(self) -> dict[str, int]:
+        """
+        キャッシュの統計情報を返す
+        戻り値：元画像数，変形済み画像数，ヒット数，ミス数，アトラスのバイト数の辞書
+        """
+        return {
+            "images": len(self.images),
+            "variants": len(self.variants),
+            "hits": self.hits,
+            "misses": self.misses,
+            "atlas_bytes": sum(atlas.nbytes() for atlas in self.atlases.values()),
+            "bundle_loads": self.bundle_loads,
+        }
+
+    @staticmethod
+    def bundle_key(path: str, angle: float = 0, scale: float = 1.0,
+                   flip: tuple[bool, bool] = (False, False), effect: str | None = None, smooth: bool = True) -> str:
+        """
+        引数：get()と同じ
+        戻り値：バンドル内で画像を引くためのキー文字列（smoothが真なら以前の版と同じキー）
+        """
+        key = [path, float(angle), float(scale), [bool(flip[0]), bool(flip[1])], effect]
+        return json.dumps(key if smooth else key+[False])
+
+    def from_bundle(self, key: str) -> pg.Surface | None:
+        """
+        バンドル内のピクセルデータから画像Surfaceを作る
+        引数 key：bundle_key()で作ったキー
+        戻り値：画像Surface（バンドルに含まれていなければNone）
+        """
+        entry = self.bundled.get(key)
+        if entry is None:
+            return None
+        offset, length = self.bundle_base+entry["offset"], entry["length"]
+        img = pg.image.frombuffer(memoryview(self.bundle)[offset:offset+length], entry["size"], entry["format"])
+        if pg.display.get_surface() is not None:
+            img = img.convert_alpha() if entry["format"] == "RGBA" else img.convert()
+        if entry["colorkey"] is not None:
+            img.set_colorkey(entry["colorkey"])
+        self.bundle_loads += 1
+        return img
+
+    def open_bundle(self, path: str = ASSET_BUNDLE) -> bool:
+        """
+        バンドルをメモリマップで開き，以降の読み込みに使う
+        バンドルを作った後に元画像のファイルが変わっていれば，その画像は使わない
+        引数 path：バンドルのパス
+        戻り値：開けたかどうか
+        """
+        try:
+            with open(os.path.join(ROOT, path), "rb") as f:
+                bundle = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return False
+        try:  # 途中で切れたり壊れたりしたバンドルは使わず，元画像から読み込む
+            magic, version, size = self.BUNDLE_HEADER.unpack_from(bundle)
+            if magic != self.BUNDLE_MAGIC or version != self.BUNDLE_VERSION:
+                return False
+            index = json.loads(bytes(bundle[self.BUNDLE_HEADER.size:self.BUNDLE_HEADER.size+size]))
+            stale = set()
+            for source, stamp in index["sources"].items():
+                try:
+                    st = os.stat(os.path.join(ROOT, source))
+                except OSError:
+                    st = None
+                if st is None or [st.st_size, st.st_mtime_ns] != stamp:
+                    stale.add(source)
+            base = self.bundle_data_start(size)
+            bundled = {
+                key: entry for key, entry in index["entries"].items()
+                if entry["source"] not in stale and base+entry["offset"]+entry["length"] <= len(bundle)
+            }
+        except (struct.error, ValueError, KeyError, TypeError):
+            return False
+        self.bundle = bundle
+        self.bundle_base = base
+        self.bundled = bundled
+        return True
+
+    def bundle_data_start(self, size: int) -> int:
+        """
+        引数 size：目次のバイト数
+        戻り値：ピクセルデータの先頭の位置（16バイト境界に揃える）
+        """
+        start = self.BUNDLE_HEADER.size+size
+        return start + -start % 16
+
+    def save_bundle(self, path: str = ASSET_BUNDLE, limit: int = BUNDLE_SOURCE_LIMIT):
+        """
+        読み込み済みの元画像と変形済み画像と回転アトラスを，ピクセルデータのままバンドルに書き出す
+        引数1 path：バンドルのパス
+        引数2 limit：これよりピクセルデータが大きい元画像は書き出さない
+        """
+        surfaces = {}  # キー→(元画像のパス，画像)
+        for source, img in self.images.items():
+            if img.get_width()*img.get_height()*4 <= limit:
+                surfaces[self.bundle_key(source)] = source, img
+        for (source, angle, scale, flip, effect, smooth), img in self.variants.items():
+            surfaces[self.bundle_key(source, angle, scale, flip, effect, smooth)] = source, img
+        for source, atlas in self.atlases.items():
+            atlas.fill()
+            for scale, frames in atlas.frames.items():
+                for i, img in enumerate(frames):
+                    surfaces[self.bundle_key(source, i*360/atlas.steps, scale)] = source, img
+
+        entries, blobs, offset = {}, [], 0
+        for key, (source, img) in surfaces.items():
+            fmt = "RGBA" if img.get_flags() & pg.SRCALPHA else "RGB"
+            colorkey = img.get_colorkey()
+            if colorkey is not None:  # カラーキーがあるとtobytes()が透明度を0か255にしてしまうので外して書き出す
+                img = img.copy()
+                img.set_colorkey(None)
+            data = pg.image.tobytes(img, fmt)
+            entries[key] = {  # offsetはピクセルデータの先頭からの位置
+                "source": source, "size": img.get_size(), "format": fmt, "length": len(data),
+                "colorkey": colorkey[:3] if colorkey is not None else None, "offset": offset,
+            }
+            blobs.append(data)
+            offset += len(data)
+        sources = {}
+        for source in {source for source, _ in surfaces.values()}:
+            st = os.stat(os.path.join(ROOT, source))
+            sources[source] = [st.st_size, st.st_mtime_ns]
+
+        index = json.dumps({"entries": entries, "sources": sources}).encode()
+        with open(os.path.join(ROOT, path), "wb") as f:
+            f.write(self.BUNDLE_HEADER.pack(self.BUNDLE_MAGIC, self.BUNDLE_VERSION, len(index)))
+            f.write(index)
+            f.write(bytes(self.bundle_data_start(len(index))-f.tell()))
+            for data in blobs:
+                f.write(data)
+
+
+class RotationAtlas:
+    """
+    量子化した角度ごとの回転済み画像を保持するクラス
+    各画像は初めて使うときに作る（fill()で全て作っておくこともできる）
+    """
+    def __init__(self, img: pg.Surface, scales: tuple[float, ...], steps: int, make=None):
+        """
+        引数1 img：元画像Surface
+        引数2 scales：生成する拡大率のタプル
+        引数3 steps：1周の角度分割数
+        引数4 make：(角度，拡大率)から回転済み画像を返す関数（Noneを返したら元画像を回転して作る）
+        """
+        self.img = img
+        self.steps = steps
+        self.make = make
+        self.frames: dict[float, list[pg.Surface | None]] = {scale: [None]*steps for scale in scales}
+
+    def frame(self, scale: float, i: int) -> pg.Surface:
+        """
+        引数1 scale：拡大率
+        引数2 i：角度の番号
+        戻り値：i*360/steps度回転した画像Surface
+        """
+        img = self.frames[scale][i]
+        if img is None:
+            angle = i*360/self.steps
+            if self.make is not None:
+                img = self.make(angle, scale)
+            if img is None:
+                img = pg.transform.rotozoom(self.img, angle, scale)
+            self.frames[scale][i] = img
+        return img
+
+    def fill(self):
+        """
+        まだ作っていない回転済み画像をすべて作る
+        """
+        for scale in self.frames:
+            for i in range(self.steps):
+                self.frame(scale, i)
+
+    def index(self, angle: float) -> int:
+        """
+        角度を最も近い量子化角度の番号に変換する
+        引数 angle：角度(度数法)
+        戻り値：0以上steps未満の番号
+        """
+        return round(angle*self.steps/360) % self.steps
+
+    def image(self, angle: float, scale: float) -> pg.Surface:
+        """
+        引数1 angle：回転角度(度数法)
+        引数2 scale：拡大率
+        戻り値：最も近い量子化角度の回転済み画像Surface
+        """
+        return self.frame(scale, self.index(angle))
+
+    def nbytes(self) -> int:
+        """
+        戻り値：保持している画像のピクセルデータの合計バイト数
+        """
+        return sum(
+            img.get_pitch()*img.get_height()
+            for frames in self.frames.values() for img in frames if img is not None
+        )
+
+
+ASSETS = Assets()
+POOLS: dict[str, "Pool"] = {}  # クラス名→スプライトのプール
+
+
+class Pool:
+    """
+    消えたスプライトを捨てずに保持し，次の生成時に再利用するクラス
+    """
+    def __init__(self, cls: type, capacity: int):
+        """
+        引数1 cls：プールするスプライトのクラス（reset()を持つこと）
+        引数2 capacity：保持しておく空きスプライトの最大数
+        """
+        self.cls = cls
+        self.capacity = capacity
+        self.free: list[pg.sprite.Sprite] = []
+        self.in_use = 0  # 使用中の数
+        self.high_water = 0  # 使用中の数の最大値
+        self.created = 0  # 新たに生成した数
+
+    def acquire(self, *args, **kwargs) -> pg.sprite.Sprite:
+        """
+        空きスプライトがあればreset()で初期化し直して返し，なければ新たに生成する
+        戻り値：初期化済みのスプライト
+        """
+        if self.free:
+            sprite = self.free.pop()
+            sprite.reset(*args, **kwargs)
+        else:
+            sprite = self.cls(*args, **kwargs)
+            self.created += 1
+        self.in_use += 1
+        self.high_water = max(self.high_water, self.in_use)
+        return sprite
+
+    def revive(self) -> pg.sprite.Sprite:
+        """
+        reset()を呼ばずに空きスプライトを取り出す（属性はスナップショットから戻す）
+        戻り値：属性が未設定のスプライト
+        """
+        if self.free:
+            sprite = self.free.pop()
+        else:
+            sprite = self.cls.__new__(self.cls)
+            pg.sprite.Sprite.__init__(sprite)
+            self.created += 1
+        self.in_use += 1
+        self.high_water = max(self.high_water, self.in_use)
+        return sprite
+
+    def release(self, sprite: pg.sprite.Sprite):
+        """
+        使い終わったスプライトを返却する（容量を超えた分は捨てる）
+        引数 sprite：返却するスプライト
+        """
+        self.in_use -= 1
+        if len(self.free) < self.capacity:
+            self.free.append(sprite)
+
+    def stats(self) -> dict[str, int]:
+        """
+        戻り値：使用中の数，空きの数，使用中の最大値，生成した数の辞書
+        """
+        return {
+            "in_use": self.in_use,
+            "free": len(self.free),
+            "high_water": self.high_water,
+            "created": self.created,
+        }
+
+
+class PooledSprite(pg.sprite.Sprite):
+    """
+    プールから再利用されるスプライトの基底クラス
+    サブクラスは__init__の代わりにreset()で状態を初期化する
+    kill()ですべてのグループから外れたときにプールへ返却される
+    """
+    capacity = 256  # プールに保持する空きスプライトの最大数
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.pool = POOLS[cls.__name__] = Pool(cls, cls.capacity)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__()
+        self.reset(*args, **kwargs)
+
+    @classmethod
+    def new(cls, *args, **kwargs) -> "PooledSprite":
+        """
+        プールから取り出したスプライトを返す
+        """
+        return cls.pool.acquire(*args, **kwargs)
+
+    def reset(self, *args, **kwargs):
+        """
+        生成時とプールから取り出したときに呼ばれ，new()の引数で状態を初期化する
+        サブクラスはimageとrectを含め，前に使われたときの属性をすべて設定し直すこと
+        """
+
+    def kill(self):
+        if self.alive():
+            super().kill()
+            self.pool.release(self)
+
+
 class Bird(pg.sprite.Sprite):
     """
     ゲームキャラクター（こうかとん）に関するクラス
@@ -44,53 +669,86 @@ class Bird(pg.sprite.Sprite):
         pg.K_LEFT: (-1, 0),
         pg.K_RIGHT: (+1, 0),
     }
+    poses = {  # 向き→(回転角度，左右反転するか)（左右反転したものがデフォルトのこうかとん）
+        (+1, 0): (0, True),  # 右
+        (+1, -1): (45, True),  # 右上
+        (0, -1): (90, True),  # 上
+        (-1, -1): (-45, False),  # 左上
+        (-1, 0): (0, False),  # 左
+        (-1, +1): (45, False),  # 左下
+        (0, +1): (-90, True),  # 下
+        (+1, +1): (-45, True),  # 右下
+    }
 
     def __init__(self, num: int, xy: tuple[int, int]):
         """
         こうかとん画像Surfaceを生成する
+        向きごとの画像とEFFECTSの効果をかけた画像はここで全て生成しておく
         引数1 num：こうかとん画像ファイル名の番号
         引数2 xy：こうかとん画像の位置座標タプル
         """
         super().__init__()
-        img0 = pg.transform.rotozoom(pg.image.load(f"fig/{num}.png"), 0, 2.0)
-        img = pg.transform.flip(img0, True, False)  # デフォルトのこうかとん
-        self.imgs = {
-            (+1, 0): img,  # 右
-            (+1, -1): pg.transform.rotozoom(img, 45, 1.0),  # 右上
-            (0, -1): pg.transform.rotozoom(img, 90, 1.0),  # 上
-            (-1, -1): pg.transform.rotozoom(img0, -45, 1.0),  # 左上
-            (-1, 0): img0,  # 左
-            (-1, +1): pg.transform.rotozoom(img0, 45, 1.0),  # 左下
-            (0, +1): pg.transform.rotozoom(img, -90, 1.0),  # 下
-            (+1, +1): pg.transform.rotozoom(img, -45, 1.0),  # 右下
+        path = f"fig/{num}.png"
+        self.fx_imgs = {  # 効果名（Noneは効果なし）→向き→画像
+            effect: {
+                dire: ASSETS.get(path, angle, 2.0, (flip, False), effect)
+                for dire, (angle, flip) in __class__.poses.items()
+            }
+            for effect in (None, *EFFECTS)
         }
+        self.imgs = self.fx_imgs[None]
         self.dire = (+1, 0)
+        self.pose = self.dire  # 表示する画像（向きのタプル，または画像ファイル名の番号）
         self.image = self.imgs[self.dire]
         self.rect = self.image.get_rect()
         self.rect.center = xy
         self.speed = 10
         self.state = "normal"
         self.hyper_life = 0
+        self.damaged_life = 0  # 被弾した見た目を続けるフレーム数
         self.life = 10  # こうかとんの初期体力
 
-    def change_img(self, num: int, screen: pg.Surface):
+    def refresh(self):
+        """
+        向きと状態に応じた生成済みの画像に切り替える
+        無敵状態なら"hyper"，被弾直後なら"damaged"の効果をかけた画像を使う
+        """
+        if self.state == "hyper":
+            effect = "hyper"
+        elif self.damaged_life > 0:
+            effect = "damaged"
+        else:
+            effect = None
+        if isinstance(self.pose, tuple):
+            self.image = self.fx_imgs[effect][self.pose]
+        else:
+            self.image = ASSETS.get(f"fig/{self.pose}.png", 0, 2.0, effect=effect)
+
+    def flash(self, life: int):
+        """
+        lifeフレームの間，被弾した見た目にする
+        引数 life：被弾した見た目を続けるフレーム数
+        """
+        self.damaged_life = life
+        self.refresh()
+
+    def change_img(self, num: int, screen: pg.Surface | None = None):
         """
-        こうかとん画像を切り替え，画面に転送する
+        こうかとん画像を切り替え，screenが指定されていれば画面に転送する
         引数1 num：こうかとん画像ファイル名の番号
         引数2 screen：画面Surface
         """
-        self.image = pg.transform.rotozoom(pg.image.load(f"fig/{num}.png"), 0, 2.0)
-        if self.state == "hyper":   # 無敵状態のとき
-            self.image = pg.transform.laplacian(self.image)
-        screen.blit(self.image, self.rect)
+        self.pose = num
+        self.refresh()
+        if screen is not None:
+            screen.blit(self.image, self.rect)
 
-    def update(self, key_lst: list[bool], screen: pg.Surface, score):
+    def update(self, key_lst: "Inputs", score):
         """
         押下キーに応じてこうかとんを移動させる
         スコアが100より大きいとき，右Shift押下で500フレームの間こうかとんが無敵状態になる
-        引数1 key_lst：押下キーの真理値リスト
-        引数2 screen：画面Surface
-        引数3 score:Scoreオブジェクト
+        引数1 key_lst：キーで引くと押下状態を返す入力オブジェクト
+        引数2 score:Scoreオブジェクト
         """
         sum_mv = [0, 0]
         for k, mv in __class__.delta.items():
@@ -98,8 +756,7 @@ class Bird(pg.sprite.Sprite):
                 sum_mv[0] += mv[0]
                 sum_mv[1] += mv[1]
         self.sum_mv = sum_mv
-        key_lst = pg.key.get_pressed()
-              
+
         self.rect.move_ip(self.speed*sum_mv[0], self.speed*sum_mv[1])
         if check_bound(self.rect) != (True, True):
             self.rect.move_ip(-self.speed*sum_mv[0], -self.speed*sum_mv[1])
@@ -110,87 +767,109 @@ class Bird(pg.sprite.Sprite):
 
         if not (sum_mv[0] == 0 and sum_mv[1] == 0):
             self.dire = tuple(sum_mv)
-            self.image = self.imgs[self.dire]
+            self.pose = self.dire
         if key_lst[pg.K_RSHIFT] and score.value >= 100:
             score.value -= 100  # スコアを100消費
             self.state = "hyper"
             self.hyper_life = 500  # 発動時間
         if self.state == "hyper":   # 無敵状態のとき
-            self.image = pg.transform.laplacian(self.image)
             self.hyper_life -= 1
             if self.hyper_life < 0:  # 無敵状態が終わったら
                 self.state = "normal"
-                self.image = self.imgs[self.dire]
-        screen.blit(self.image, self.rect)
+        if self.damaged_life > 0:
+            self.damaged_life -= 1
+        self.refresh()
 
 
-class Bomb(pg.sprite.Sprite):
+class Bomb:
     """
-    爆弾に関するクラス
+    爆弾に関するクラス（爆弾はWorldの"bombs"のTableに1行ずつ出現させる）
     """
     colors = [(255, 0, 0), (0, 255, 0), (0, 0, 255), (255, 255, 0), (255, 0, 255), (0, 255, 255)]
+    radii = range(10, 51)  # 爆弾円の半径：10以上50以下
+    imgs: dict[tuple[int, tuple], pg.Surface] = {}  # (半径，色)→爆弾円Surface（すべての爆弾で共有する）
 
-    def __init__(self, emy: "Enemy", bird: Bird, score):
+    @classmethod
+    def images(cls) -> list[pg.Surface]:
         """
-        爆弾円Surfaceを生成する
-        引数1 emy：爆弾を投下する敵機
-        引数2 bird：攻撃対象のこうかとん
+        戻り値：画像番号→爆弾円Surfaceのリスト（すべての半径と色の組み合わせ）
         """
-        super().__init__()
-        rad = random.randint(10, 50)  # 爆弾円の半径：10以上50以下の乱数
-        self.image = pg.Surface((2*rad, 2*rad))
-        color = random.choice(__class__.colors)  # 爆弾円の色：クラス変数からランダム選択
-        pg.draw.circle(self.image, color, (rad, rad), rad)
-        self.image.set_colorkey((0, 0, 0))
-        self.rect = self.image.get_rect()
-        # 爆弾を投下するemyから見た攻撃対象のbirdの方向を計算
-        self.vx, self.vy = calc_orientation(emy.rect, bird.rect)  
-        self.rect.centerx = emy.rect.centerx
-        self.rect.centery = emy.rect.centery+emy.rect.height/2
+        return [cls.sprite(rad, color) for rad in cls.radii for color in cls.colors]
 
-        # self.bosvx, self.bosvy = calc_orientation(bos.rect, bird.rect)  
-        # self.rect.centerx = bos.rect.centerx
-        # self.rect.centery = bos.rect.centery+bos.rect.height/2
+    @classmethod
+    def frame(cls, rad: int, color: tuple) -> int:
+        """
+        引数1 rad：爆弾円の半径
+        引数2 color：爆弾円の色
+        戻り値：images()の中の画像番号
+        """
+        return (rad-cls.radii.start)*len(cls.colors)+cls.colors.index(color)
 
-        self.speed = 6
-        self.state="active"
+    @classmethod
+    def sprite(cls, rad: int, color: tuple) -> pg.Surface:
+        """
+        引数1 rad：爆弾円の半径
+        引数2 color：爆弾円の色
+        戻り値：爆弾円Surface（初回のみ生成する．共有されるため書き換えないこと）
+        """
+        img = cls.imgs.get((rad, color))
+        if img is None:
+            img = pg.Surface((2*rad, 2*rad))
+            pg.draw.circle(img, color, (rad, rad), rad)
+            if pg.display.get_surface() is not None:
+                img = img.convert()
+            img.set_colorkey((0, 0, 0), pg.RLEACCEL)
+            cls.imgs[rad, color] = img
+        return img
+
+    @classmethod
+    def spawn(cls, bombs: "Table", emy: "Enemy", bird: Bird, score, rng: random.Random):
+        """
+        爆弾を投下する
+        引数1 bombs：爆弾のTable
+        引数2 emy：爆弾を投下する敵機
+        引数3 bird：攻撃対象のこうかとん
+        引数4 score：得点（得点に応じてスピードを変える）
+        引数5 rng：大きさと色を決める乱数生成器
+        """
+        rad = rng.randint(10, 50)  # 爆弾円の半径：10以上50以下の乱数
+        color = rng.choice(cls.colors)  # 爆弾円の色：クラス変数からランダム選択
+        rect = pg.Rect(0, 0, 2*rad, 2*rad)
+        rect.centerx = emy.rect.centerx
+        rect.centery = emy.rect.centery+emy.rect.height/2
+        speed = 6
         if score.value >= 100:  # 得点に応じてスピードを変更
-            self.speed = 7 
+            speed = 7
         if score.value >= 200:
-            self.speed = 8
+            speed = 8
         if score.value >= 300:
-            self.speed = 9 
-
-    def update(self):
-        """
-        爆弾を速度ベクトルself.vx, self.vyに基づき移動させる
-        引数 screen：画面Surface
-        """
-        yoko, tate = check_bound(self.rect)  
-        if not yoko:
-            self.vx *= -1   # 爆弾を反射させる
-        if not tate:
-            self.vy *= -1
-        self.rect.move_ip(self.speed*self.vx, self.speed*self.vy)
-
-        # self.rect.move_ip(self.speed*self.bosvx, self.speed*self.bosvy)
-        #if check_bound(self.rect) != (True, True):
-            # self.kill()
-
-
-class Beam(pg.sprite.Sprite):
+            speed = 9
+        bombs.add(
+            pos=rect.center,
+            vel=calc_orientation(emy.rect, bird.rect),  # 爆弾を投下するemyから見た攻撃対象のbirdの方向
+            speed=speed,
+            radius=rad,  # 衝突判定は円で行う
+            active=True,
+            frame=cls.frame(rad, color),
+        )
+
+
+class Beam(PooledSprite):
     """
     ビームに関するクラス
     """
-    def __init__(self, bird: Bird, angle0 : float = 0, a=2.0):
+    capacity = 128
+    saved = {"vx": "f", "vy": "f", "angle": "f", "speed": "i", "time": "i", "scale": "f"}  # スナップショットに保存する属性→型
+
+    def reset(self, bird: Bird, angle0 : float = 0, a=2.0):
         """
         ビーム画像Surfaceを生成する
         引数 bird：ビームを放つこうかとん
         """
-        super().__init__()
         self.vx, self.vy = bird.dire
         self.angle = angle0 + math.degrees(math.atan2(-self.vy, self.vx))
-        self.image = pg.transform.rotozoom(pg.image.load(f"fig/beam.png"), self.angle, a)
+        self.scale = a
+        self.redraw()
         self.vx = math.cos(math.radians(self.angle))
         self.vy = -math.sin(math.radians(self.angle))
         self.rect = self.image.get_rect()
@@ -199,6 +878,12 @@ class Beam(pg.sprite.Sprite):
         self.speed = 10
         self.time = 0
 
+    def redraw(self):
+        """
+        角度と拡大率から画像を用意する
+        """
+        self.image = ASSETS.rotated("fig/beam.png", self.angle, self.scale)
+
     def update(self):
         """
         ビームを速度ベクトルself.vx, self.vyに基づき移動させる
@@ -208,7 +893,7 @@ class Beam(pg.sprite.Sprite):
                 print(self.time)
                 
                 self.time -= 1
-                self.image = pg.transform.rotozoom(pg.image.load(f"fig/beam.png"), self.angle, 6.0)
+                self.image = ASSETS.rotated("fig/beam.png", self.angle, 6.0)
         self.rect.move_ip(self.speed*self.vx, self.speed*self.vy)
         if check_bound(self.rect) != (True, True):
             self.kill()
@@ -227,106 +912,143 @@ class NeoBeam:
     def gen_beams(self):
         beams = []
         for angle in range(-50, +51, 100//(self.num-1)):
-            beam = Beam(self.bird, angle, self.b)
+            beam = Beam.new(self.bird, angle, self.b)
             beams.append(beam)
         return beams
 
 
-class Explosion(pg.sprite.Sprite):
-    """
-    爆発に関するクラス
-    """
-    def __init__(self, obj: "Bomb|Enemy", life: int):
-        """
-        爆弾が爆発するエフェクトを生成する
-        引数1 obj：爆発するBombまたは敵機インスタンス
-        引数2 life：爆発時間
-        """
-        super().__init__()
-        img = pg.image.load(f"fig/explosion.gif")
-        self.imgs = [img, pg.transform.flip(img, 1, 1)]
-        self.image = self.imgs[0]
-        self.rect = self.image.get_rect(center=obj.rect.center)
-        self.life = life
-
-    def update(self):
-        """
-        爆発時間を1減算した爆発経過時間_lifeに応じて爆発画像を切り替えることで
-        爆発エフェクトを表現する
-        """
-        self.life -= 1
-        self.image = self.imgs[self.life//10%2]
-        if self.life < 0:
-            self.kill()
-
-
 class Enemy(pg.sprite.Sprite):
     """
     敵機に関するクラス
     """
-    imgs = [pg.image.load(f"fig/alien{i}.png") for i in range(1, 4)]
+    imgs = [f"fig/alien{i}.png" for i in range(1, 4)]
+    saved = {"vy": "i", "bound": "i", "state": "s", "interval": "n", "path": "s"}  # スナップショットに保存する属性→型
     
-    def __init__(self):
+    def __init__(self, rng: random.Random):
+        """
+        引数 rng：画像，出現位置，停止位置，爆弾投下インターバルを決める乱数生成器
+        """
         super().__init__()
-        self.image = random.choice(__class__.imgs)
+        self.path = rng.choice(__class__.imgs)
+        self.image = ASSETS.get(self.path)
         self.rect = self.image.get_rect()
-        self.rect.center = random.randint(0, WIDTH), 0
+        self.rect.center = rng.randint(0, WIDTH), 0
         self.vy = +6
-        self.bound = random.randint(50, HEIGHT/2)  # 停止位置
+        self.bound = rng.randint(50, HEIGHT//2)  # 停止位置
         self.state = "down"  # 降下状態or停止状態
-        self.interval = random.randint(50, 200)  # 爆弾投下インターバル
+        self.interval = rng.randint(50, 200)  # 爆弾投下インターバル
 
-    def update(self):
+    def redraw(self):
+        """
+        EMPで無力化されていればその見た目の画像を用意する
+        """
+        self.image = ASSETS.get(self.path, effect="emp" if math.isinf(self.interval) else None)
+
+    def update(self, on_stop=None):
         """
         敵機を速度ベクトルself.vyに基づき移動（降下）させる
         ランダムに決めた停止位置_boundまで降下したら，_stateを停止状態に変更する
-        引数 screen：画面Surface
+        引数 on_stop：停止状態になったときに自身を渡して呼ぶ関数
         """
         if self.rect.centery > self.bound:
             self.vy = 0
+            if self.state != "stop" and on_stop is not None:
+                on_stop(self)
             self.state = "stop"
         self.rect.centery += self.vy
 
 
 class Gravity(pg.sprite.Sprite):
+    saved = {"life": "i"}  # スナップショットに保存する属性→型
+
     def __init__(self, life : int):
         super().__init__()
         self.life = life
-        self.image = pg.Surface((WIDTH, HEIGHT))
-        color = (0, 0, 0)
-        pg.draw.rect(self.image, color, (0, 0, WIDTH, HEIGHT))
-        self.image.set_alpha(128)
-        self.rect = self.image.get_rect()
-    
-    def update(self):
-        self.life -= 1
-        if self.life <= 0:
-            self.kill()
+        self.rect = pg.Rect(0, 0, WIDTH, HEIGHT)  # 画面全体（暗くする表示はOverlayStackが行う）
 
 
 class Shield(pg.sprite.Sprite):
     """
     防御壁に関するクラス    
     """
+    saved = {"life": "i", "vx": "i", "vy": "i", "angle": "f", "length": "i"}  # スナップショットに保存する属性→型
+
     def __init__(self, bird : Bird, life : int):
         super().__init__()
         self.life = life
-        x, y = 20, bird.rect.height*2
-        self.image = pg.Surface((x, y))
-        color = (0, 0, 255)
-        pg.draw.rect(self.image, color, (0, 0, x, y))
+        self.length = bird.rect.height*2
         self.vx, self.vy = bird.dire
         self.angle = math.degrees(math.atan2(-self.vy, self.vx))
-        self.image = pg.transform.rotozoom(self.image, self.angle, 1.0)
-        self.image.set_colorkey((0, 0, 0))
+        self.redraw()
         self.rect = self.image.get_rect()
         self.rect.centery = bird.rect.centery+bird.rect.height*bird.dire[1]
         self.rect.centerx = bird.rect.centerx+bird.rect.width*bird.dire[0]
 
-    def update(self):
-        self.life -= 1
-        if self.life < 0:
-            self.kill()
+    def redraw(self):
+        """
+        長さと角度から画像を用意する
+        """
+        x, y = 20, self.length
+        self.image = pg.Surface((x, y))
+        color = (0, 0, 255)
+        pg.draw.rect(self.image, color, (0, 0, x, y))
+        self.image = pg.transform.rotozoom(self.image, self.angle, 1.0)
+        self.image.set_colorkey((0, 0, 0))
+
+
+class GlyphAtlas:
+    """
+    フォントで描いた文字列の画像をキャッシュし，それを並べて文字列の画像を組み立てるクラス
+    数字は1文字ずつキャッシュするので，値が変わってもフォントで描き直さずに済む
+    """
+    atlases: dict[tuple[int, tuple], "GlyphAtlas"] = {}  # (文字の大きさ，色)→GlyphAtlas
+
+    def __init__(self, size: int, color: tuple):
+        """
+        引数1 size：文字の大きさ
+        引数2 color：文字の色
+        """
+        self.font = pg.font.Font(None, size)
+        self.color = color
+        self.glyphs: dict[str, pg.Surface] = {}  # 文字列→画像
+
+    @classmethod
+    def get(cls, size: int, color: tuple) -> "GlyphAtlas":
+        """
+        大きさと色が同じGlyphAtlasを共有して返す
+        引数1 size：文字の大きさ
+        引数2 color：文字の色
+        戻り値：GlyphAtlas
+        """
+        atlas = cls.atlases.get((size, color))
+        if atlas is None:
+            atlas = cls.atlases[size, color] = cls(size, color)
+        return atlas
+
+    def glyph(self, text: str) -> pg.Surface:
+        """
+        文字列の画像を返す（初回のみフォントで描く）
+        引数 text：文字列
+        戻り値：文字列の画像Surface（共有されるため書き換えないこと）
+        """
+        img = self.glyphs.get(text)
+        if img is None:
+            img = self.glyphs[text] = self.font.render(text, 0, self.color)
+        return img
+
+    def render(self, parts: list[str]) -> pg.Surface:
+        """
+        キャッシュした画像を左から並べて1枚の画像を作る
+        引数 parts：並べる文字列のリスト
+        戻り値：透過付きの画像Surface
+        """
+        glyphs = [self.glyph(part) for part in parts]
+        img = pg.Surface((sum(glyph.get_width() for glyph in glyphs), self.font.get_height()), pg.SRCALPHA)
+        x = 0
+        for glyph in glyphs:
+            img.blit(glyph, (x, 0))
+            x += glyph.get_width()
+        return img
 
 
 class Score:
@@ -334,93 +1056,265 @@ class Score:
     打ち落とした爆弾，敵機の数のスコアとこうかとんの体力を表示するクラス
     爆弾：1点
     敵機：10点
+    画像は値が変わったときだけ，見出しと数字のキャッシュ画像を並べて作り直す
     """
-    def __init__(self, text: str, color: tuple, xy: tuple):
+    def __init__(self, text: str, color: tuple, xy: tuple, source=None):
+        """
+        引数1 text：見出しの文字列
+        引数2 color：文字の色
+        引数3 xy：表示位置の左上座標
+        引数4 source：表示する値を返す関数（Noneならvalueに代入された値を表示する）
+        """
         self.text = text
-        self.font = pg.font.Font(None, 50)
+        self.atlas = GlyphAtlas.get(50, color)
 
         #self.boss=0
 
         self.color = color
+        self.source = source
         self.value = 0
-        self.image = self.font.render(f"{self.text}: {self.value}", 0, self.color)
-        self.rect = self.image.get_rect()
-        self.rect.left = xy[0]
-        self.rect.y = xy[1]
-
-    def update(self, screen: pg.Surface):
-        self.image = self.font.render(f"{self.text}: {self.value}", 0, self.color)
-        screen.blit(self.image, self.rect)
+        self.shown = None  # 画像に描かれている値
+        self.rect = pg.Rect(xy[0], xy[1], 0, 0)
+        self.render()
 
+    def render(self) -> bool:
+        """
+        値が変わっていれば表示用の画像を作り直す
+        戻り値：作り直したかどうか
+        """
+        if self.source is not None:
+            self.value = self.source()
+        if self.value == self.shown:
+            return False
+        self.shown = self.value
+        self.image = self.atlas.render([f"{self.text}: ", *str(self.value)])
+        self.rect.size = self.image.get_size()
+        return True
 
-class EMP():  # empに関するクラス
-    def __init__(self,emys: pg.sprite.Group ,bombs: pg.sprite.Group, screen : pg.Surface):
-        for emy in emys:
-            emy.interval = math.inf
-            emy.image=pg.transform.laplacian(emy.image)
-            emy.image.set_colorkey((0,0,0))
-        for bomb in bombs:
-            bomb.speed/=2
-            bomb.state="inactive"
+    def update(self, screen: pg.Surface) -> pg.Rect:
+        self.render()
+        return screen.blit(self.image, self.rect)
 
 
+class HUD:
+    """
+    スコアや体力などの表示をまとめて1枚の画像に合成するクラス
+    どれかの値が変わったときだけ合成し直すので，毎フレームの描画は1回の転送で済む
+    """
+    def __init__(self, items: list[Score] = ()):
+        """
+        引数 items：表示する項目のリスト
+        """
+        self.items = list(items)
+        self.image = pg.Surface((0, 0))
+        self.rect = pg.Rect(0, 0, 0, 0)
+        self.composites = 0  # 合成し直した回数
+        self.stale = True
 
-#itemに関するクラス
-class Spanner(pg.sprite.Sprite):
-    
+    def add(self, item: Score):
+        """
+        表示する項目を追加する
+        引数 item：表示する項目
+        """
+        self.items.append(item)
+        self.stale = True
 
-    def __init__(self, obj: "Enemy"):
+    def update(self):
         """
-        アイテムを生成する
-        引数1 obj：爆発する敵機インスタンス
+        値が変わった項目があれば画像を合成し直す
         """
-        super().__init__()
-        img = pg.image.load(f"fig/spanner.png")
-        self.image = pg.transform.scale(img, (img.get_width() * 0.1, img.get_height() * 0.1)) #画像を縮小
-        self.rect = self.image.get_rect(center=obj.rect.center)
-        self.speed = 3
-        self.time = 500
+        changed = [item.render() for item in self.items]
+        if not (self.stale or any(changed)) or not self.items:
+            return
+        self.rect = self.items[0].rect.unionall([item.rect for item in self.items])
+        self.image = pg.Surface(self.rect.size, pg.SRCALPHA)
+        for item in self.items:
+            self.image.blit(item.image, item.rect.move(-self.rect.x, -self.rect.y))
+        self.composites += 1
+        self.stale = False
+
+    def draw(self, screen: pg.Surface) -> pg.Rect:
+        """
+        合成した画像を画面に転送する
+        引数 screen：画面Surface
+        戻り値：描画したRect
+        """
+        self.update()
+        return screen.blit(self.image, self.rect)
 
 
-    def update(self):
-        self.rect.y += self.speed #下方向に落下
-    
+class Overlay:
+    """
+    画面全体に重ねる半透明の単色の効果に関するクラス
+    画像は1度だけ作って使い回し，不透明度だけをフレームごとに目標値へ近づける
+    """
+    def __init__(self, color: tuple, alpha: int, fade_in: int, fade_out: int):
+        """
+        引数1 color：色
+        引数2 alpha：表示中の不透明度
+        引数3 fade_in：現れるまでのフレーム数（0ならすぐに現れる）
+        引数4 fade_out：消えるまでのフレーム数（0ならすぐに消える）
+        """
+        self.image = pg.Surface((WIDTH, HEIGHT))
+        if pg.display.get_surface() is not None:
+            self.image = self.image.convert()
+        self.image.fill(color)
+        self.alpha = alpha
+        self.fade_in = fade_in
+        self.fade_out = fade_out
+        self.level = 0.0  # 現在の不透明度
+        self.target = 0  # 目標の不透明度
+
+    def show(self):
+        """
+        fade_inフレームかけて現れるようにする
+        """
+        self.target = self.alpha
 
-class Double(pg.sprite.Sprite):
-    def __init__(self, obj: "Enemy"):
+    def hide(self):
         """
-        アイテムを生成する
-        引数1 obj：爆発する敵機インスタンス
+        fade_outフレームかけて消えるようにする
         """
-        super().__init__()
-        img = pg.image.load(f"fig/double.png")
-        self.image = pg.transform.scale(img, (img.get_width() * 0.03, img.get_height() * 0.03)) #画像を縮小
-        self.rect = self.image.get_rect(center=obj.rect.center)
-        self.speed = 3
+        self.target = 0
+
+    def flash(self):
+        """
+        すぐに最大の不透明度で表示し，fade_outフレームかけて消えるようにする
+        """
+        self.level = self.alpha
+        self.target = 0
 
     def update(self):
-        self.rect.y += self.speed #下方向に落下
+        """
+        不透明度を1フレーム分だけ目標値に近づける
+        """
+        if self.level < self.target:
+            step = self.alpha/self.fade_in if self.fade_in > 0 else self.alpha
+            self.level = min(self.level+step, self.target)
+        elif self.level > self.target:
+            step = self.alpha/self.fade_out if self.fade_out > 0 else self.alpha
+            self.level = max(self.level-step, self.target)
 
 
-class BOSS(pg.sprite.Sprite):
+class OverlayStack:
+    """
+    Overlayをまとめて管理し，表示の更新の直前に1度だけ画面に重ねるクラス
+    """
+    def __init__(self, specs: dict[str, tuple] = OVERLAYS):
+        """
+        引数 specs：名前→Overlayの引数のタプルの辞書
+        """
+        self.overlays = {name: Overlay(*spec) for name, spec in specs.items()}
+
+    def __getitem__(self, name: str) -> Overlay:
+        return self.overlays[name]
+
+    def update(self):
+        """
+        すべてのOverlayの不透明度を1フレーム分進める
+        """
+        for overlay in self.overlays.values():
+            overlay.update()
+
+    def visible(self) -> bool:
+        """
+        戻り値：画面に重なっているOverlayがあるかどうか
+        """
+        return any(overlay.level >= 1 for overlay in self.overlays.values())
+
+    def draw(self, screen: pg.Surface, skip=()) -> list[pg.Rect]:
+        """
+        表示中のOverlayを順に画面に重ねる
+        引数1 screen：画面Surface
+        引数2 skip：重ねないOverlayの名前の集まり
+        戻り値：描画したRectのリスト
+        """
+        rects = []
+        for name, overlay in self.overlays.items():
+            if overlay.level >= 1 and name not in skip:
+                overlay.image.set_alpha(int(overlay.level))
+                rects.append(screen.blit(overlay.image, (0, 0)))
+        return rects
+
+
+class EMP():  # empに関するクラス
+    def __init__(self,emys: pg.sprite.Group ,bombs: "Table"):
+        for emy in emys:
+            emy.interval = math.inf
+            emy.redraw()  # 生成済みの画像に切り替える
+        bombs["speed"] /= 2
+        bombs["active"] = False
+
+
+
+#itemに関するクラス
+class Item:
+    """
+    敵機を倒すと出現して下に落ちるアイテムに関するクラス（アイテムはWorldのTableに1行ずつ出現させる）
+    """
+    path = ""  # 画像のパス
+    scale = 1.0  # 画像の拡大率
+    speed = 3  # 落下速度
+
+    @classmethod
+    def images(cls) -> list[pg.Surface]:
+        """
+        戻り値：画像番号→画像Surfaceのリスト
+        """
+        return [ASSETS.get(cls.path, 0, cls.scale, smooth=False)]  #画像を縮小
+
+    @classmethod
+    def spawn(cls, items: "Table", obj: "Enemy"):
+        """
+        アイテムを出現させる
+        引数1 items：アイテムのTable
+        引数2 obj：爆発する敵機インスタンス
+        """
+        items.add(pos=obj.rect.center, vel=(0, cls.speed))  #下方向に落下
+
+
+class Spanner(Item):
+    path = "fig/spanner.png"
+    scale = 0.1
+
+
+class Double(Item):
+    path = "fig/double.png"
+    scale = 0.03
+
+
+class BOSS(pg.sprite.Sprite):
     """
     ボスに関するクラス
     """    
-    image = pg.transform.rotozoom(pg.image.load(f"fig/ufo_8.png"), 0, 0.6)
+    attacks = (  # (周期, 位相, BULLET_PATTERNSのパターン名)：停止してからのフレーム数を周期で割った余りが位相のときに撃つ
+        (150, 75, "fan"),
+        (100, 0, "spiral"),
+    )
+    saved = {"vy": "i", "life": "i", "bound": "f", "state": "s", "interval": "n"}  # スナップショットに保存する属性→型
 
-    def __init__(self):
+    def __init__(self, rng: random.Random):
+        """
+        引数 rng：爆弾投下インターバルを決める乱数生成器
+        """
         super().__init__()
+        self.redraw()
         self.rect = self.image.get_rect()
         self.rect.center = WIDTH/2, -100
         self.vy = +6
         self.life=20
         self.bound = HEIGHT/5  # 停止位置
         self.state = "down"  # 降下状態or停止状態
-        self.interval = random.randint(10, 80)  # 爆弾投下インターバル
+        self.interval = rng.randint(10, 80)  # 爆弾投下インターバル
 
-    def update(self):
+    def redraw(self):
+        self.image = ASSETS.get("fig/ufo_8.png", 0, 0.6)
+
+    def update(self, on_stop=None):
         if self.rect.centery > self.bound:
             self.vy = 0
+            if self.state != "stop" and on_stop is not None:
+                on_stop(self)
             self.state = "stop"
         self.rect.centery += self.vy
 
@@ -435,41 +1329,43 @@ class Enemy2(pg.sprite.Sprite):
     """
     敵2に関するクラス
     """
-    def __init__(self):
+    attacks = (  # (周期, 位相, BULLET_PATTERNSのパターン名)：活動を始めてからのフレーム数を周期で割った余りが位相のときに撃つ
+        (500, 100, "ring"),
+        (50, 25, "aim"),
+        (150, 35, "predict"),
+        (15, 14, "spray"),
+    )
+    saved = {"life": "i", "vx": "i", "vy": "i", "bound_x": "i", "bound_y": "i", "state": "s"}  # スナップショットに保存する属性→型
+
+    def __init__(self, rng: random.Random):
+        """
+        引数 rng：出現位置と横の速さを決める乱数生成器
+        """
         super().__init__()
-        self.tmr = 0  #タイマー
         self.life = 30  #HP
-        self.image = pg.transform.rotozoom(pg.image.load(f"fig/satellite.png"), 0, 0.7)
+        self.redraw()
         self.rect = self.image.get_rect()
-        self.rect.center = (random.randint(WIDTH//10, WIDTH - WIDTH//10), 0)
-        self.vx = random.randint(3, 5)
+        self.rect.center = (rng.randint(WIDTH//10, WIDTH - WIDTH//10), 0)
+        self.vx = rng.randint(3, 5)
         self.vy = +2  #降下速度
         self.bound_x = WIDTH//12  #横に動ける範囲
         self.bound_y = HEIGHT//6  #縦に動ける範囲
         self.state = "down"
+
+    def redraw(self):
+        self.image = ASSETS.get("fig/satellite.png", 0, 0.7)
     
-    def update(self, bullets : pg.sprite.Group, bird : Bird):
+    def update(self, on_move=None):
         """
         敵機を速度ベクトルself.vyに基づき移動（降下）させる
         停止位置_bound_yまで降下したら，_stateを活動状態に変更する
-        引数1 bullets : 弾のGroupオブジェクト
-        引数2 bird : こうかとんクラス
-        """
-        #一定間隔で攻撃を行う
-        if self.tmr % 500 == 100 :
-            self.n_way(12, random.randint(4, 7), bullets, bird)
-        if self.tmr % 50 == 25:
-            self.n_way(1, 6.0, bullets, bird)
-        if self.tmr % 150 == 35:
-            self.predict(16, bullets, bird)
-        if self.tmr % 15 == 14:
-            bullets.add(Bullet(5, random.randint(0, 359), self))
-        
+        引数 on_move : 活動状態になったときに自身を渡して呼ぶ関数（攻撃の予約に使う）
+        """
         #降下しきるまで活動しない
-        if self.state != "down":
-            self.tmr += 1
         if self.rect.centery > self.bound_y:
             self.vy = 0
+            if self.state == "down" and on_move is not None:
+                on_move(self)
             self.state = "move"
         
         #左右に動かす処理
@@ -480,334 +1376,2349 @@ class Enemy2(pg.sprite.Sprite):
             self.rect.move_ip(self.vx, 0)
         self.rect.centery += self.vy
 
-    def PlusMin(self, a, b):
+
+class Table:
+    """
+    同じ種類のエンティティの成分(component)を，成分ごとに連続したNumPy配列で持つクラス
+    生きているエンティティは配列の先頭n個に詰めて出現順に並べ，処理は配列全体に対して一括で行う
+    """
+    dtypes = {  # 成分名→(型，1体あたりの形)
+        "pos": (np.float64, (2,)),  # 中心座標
+        "prev": (np.float64, (2,)),  # remember()したときの中心座標（補間して描くため）
+        "frame": (np.intp, ()),  # 画像番号
+        "shape": (np.intp, ()),  # 当たり判定と画面外の判定に使う画像番号（表示するframeを粗くできるTableだけが持つ）
+        "born": (np.int64, ()),  # 出現したフレーム（Lifecycleが初めて見たときに設定する，-1なら未設定）
+        "idle": (np.int64, ()),  # 無力化を確認したフレーム（-1なら有効）
+        "vel": (np.float64, (2,)),  # 速度ベクトル（speedがあれば掛けて進む）
+        "speed": (np.float64, ()),  # 速さ
+        "radius": (np.float64, ()),  # 円の当たり判定の半径（この成分がなければRectで判定する）
+        "active": (np.bool_, ()),  # 有効か（EMPで無力化されるとFalse）
+    }
+    base = ("pos", "prev", "frame", "born", "idle")  # すべてのTableが持つ成分
+    defaults = {"born": -1, "idle": -1}  # 成分名→add()で値を渡さなかったときの値（ここになければ0）
+    hitbox = "frame"  # rects()で大きさを引く画像番号の成分名
+
+    def __init__(self, components: tuple[str, ...], images, capacity: int = 256):
         """
-        0以上であるもののうち最も小さい数を返す関数
+        引数1 components：baseの他に持つ成分名のタプル
+        引数2 images：画像番号→画像Surfaceのリストを返す関数（最初にエンティティを追加するときに呼ぶ）
+        引数3 capacity：最初に確保するエンティティの数（足りなくなったら倍にする）
         """
-        if a < 0 and b < 0:
-            return 0
-        if a < 0:
-            return b
-        if b < 0:
-            return a
-        if a < b:
-            return a
+        self.images = images
+        self.frames: list[pg.Surface] | None = None
+        self.half = self.size = None  # 画像番号→画像の幅・高さの半分，幅・高さの配列
+        self.n = 0  # 生きているエンティティの数
+        self.bounds = None  # rects()の結果（位置・画像番号・数が変わったら作り直す）
+        self.box: pg.Rect | None = None  # 全エンティティを囲むRect（boundsと同時に作り直す）
+        self.cols: dict[str, np.ndarray] = {}  # 成分名→配列
+        for name in self.base+tuple(components):
+            dtype, shape = self.dtypes[name]
+            self.cols[name] = np.zeros((capacity,)+shape, dtype=dtype)
+
+    def __len__(self) -> int:
+        return self.n
+
+    def load(self):
+        """
+        画像を用意する
+        """
+        self.frames = self.images()
+        self.half = np.array([(img.get_width()//2, img.get_height()//2) for img in self.frames])
+        self.size = np.array([img.get_size() for img in self.frames])
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        """
+        引数 name：成分名
+        戻り値：生きているエンティティの成分の配列（書き換えるとTableに反映される．
+                posとframeはtable[name] = 値の形で書き換えること）
+        """
+        return self.cols[name][:self.n]
+
+    def __setitem__(self, name: str, value):
+        self.cols[name][:self.n] = value
+        self.bounds = self.box = None
+
+    def add(self, k: int = 1, **values) -> slice:
+        """
+        エンティティを末尾に追加する
+        引数1 k：追加する数
+        引数2 values：成分名→値（k体分の配列，または全員に同じ値）
+        戻り値：追加したエンティティの範囲
+        """
+        if self.frames is None:
+            self.load()
+        if self.n+k > len(self.cols["pos"]):
+            self.reserve(self.n+k)
+        sl = slice(self.n, self.n+k)
+        for name, arr in self.cols.items():
+            arr[sl] = self.defaults.get(name, 0)
+        for name, value in values.items():
+            self.cols[name][sl] = value
+        self.cols["prev"][sl] = self.cols["pos"][sl]
+        self.n += k
+        self.bounds = self.box = None
+        return sl
+
+    def reserve(self, capacity: int):
+        """
+        配列の大きさをcapacity以上に広げる
+        引数 capacity：必要なエンティティの数
+        """
+        size = len(self.cols["pos"])
+        while size < capacity:
+            size *= 2
+        for name, old in self.cols.items():
+            new = np.zeros((size,)+old.shape[1:], dtype=old.dtype)
+            new[:self.n] = old[:self.n]
+            self.cols[name] = new
+
+    def keep(self, mask: np.ndarray):
+        """
+        maskがTrueのエンティティだけを残し，順序を保ったまま配列の前に詰める
+        引数 mask：生きているエンティティそれぞれを残すかどうかの配列
+        """
+        m = int(np.count_nonzero(mask))
+        if m == self.n:
+            return
+        for arr in self.cols.values():
+            arr[:m] = arr[:self.n][mask]
+        self.n = m
+        self.bounds = self.box = None
+
+    def rects(self, pos: np.ndarray | None = None) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        引数 pos：中心座標の配列（Noneなら現在の位置）
+        戻り値：生きているエンティティのRectの左端，上端，右端，下端の配列（大きさはhitboxの成分の画像から引く）
+        """
+        if pos is None and self.bounds is not None:
+            return self.bounds
+        n = self.n
+        frame = self.cols[self.hitbox][:n]
+        current = pos is None
+        if current:
+            pos = self.cols["pos"][:n]
+        topleft = pos.astype(int)-self.half[frame]
+        bottomright = topleft+self.size[frame]
+        bounds = topleft[:, 0], topleft[:, 1], bottomright[:, 0], bottomright[:, 1]
+        if current:
+            self.bounds = bounds
+        return bounds
+
+    def bbox(self) -> pg.Rect:
+        """
+        戻り値：生きているエンティティ全体を囲むRect（1体以上いること）
+        """
+        if self.box is None:
+            left, top, right, bottom = self.rects()
+            x, y = int(left.min()), int(top.min())
+            self.box = pg.Rect(x, y, int(right.max())-x, int(bottom.max())-y)
+        return self.box
+
+    def hit_mask(self, rect: pg.Rect) -> np.ndarray:
+        """
+        引数 rect：判定するRect
+        戻り値：rectと重なるエンティティではTrueとなる配列（radiusの成分があれば円として判定する）
+        """
+        if not self.bbox().colliderect(rect):  # どのエンティティとも重ならない
+            return np.zeros(self.n, dtype=bool)
+        left, top, right, bottom = self.rects()
+        mask = (left < rect.right) & (right > rect.left) & (top < rect.bottom) & (bottom > rect.top)
+        radius = self.cols.get("radius")
+        if radius is not None and mask.any():
+            mask &= circles_hit_rect(self.cols["pos"][:self.n], radius[:self.n], rect)
+        return mask
+
+    def spritecollide(self, sprite: pg.sprite.Sprite, dokill: bool) -> list["Entity"]:
+        """
+        スプライトと重なるエンティティを調べる
+        引数1 sprite：判定するスプライト
+        引数2 dokill：重なったエンティティを消すかどうか
+        戻り値：重なったエンティティのリスト（出現順）
+        """
+        if self.n == 0:
+            return []
+        mask = self.hit_mask(sprite.rect)
+        hits = [Entity(self, i) for i in np.flatnonzero(mask).tolist()]
+        if dokill and hits:
+            self.keep(~mask)
+        return hits
+
+    def groupcollide(self, group: pg.sprite.AbstractGroup, dokill: bool, dokillb: bool = False) -> dict:
+        """
+        グループ内のスプライトと重なるエンティティを調べる
+        pg.sprite.groupcollideと同じく，dokillbなら相手は出現順で最初に重なったエンティティにだけ当たって消える
+        引数1 group：判定するグループ
+        引数2 dokill：重なったエンティティを消すかどうか
+        引数3 dokillb：重なった相手のスプライトを消すかどうか
+        戻り値：重なったエンティティ→重なったスプライトのリストの辞書（出現順）
+        """
+        if self.n == 0:
+            return {}
+        crashed: dict[int, list] = {}
+        mask = np.zeros(self.n, dtype=bool)
+        for sprite in group.sprites():
+            hits = np.flatnonzero(self.hit_mask(sprite.rect))
+            if len(hits) == 0:
+                continue
+            if dokillb:
+                hits = hits[:1]
+                sprite.kill()
+            for i in hits.tolist():
+                crashed.setdefault(i, []).append(sprite)
+            mask[hits] = True
+        crashed = {Entity(self, i): crashed[i] for i in sorted(crashed)}
+        if dokill:
+            self.keep(~mask)
+        return crashed
+
+    def remember(self):
+        """
+        現在の位置を覚えておく（描画で前後の状態の間を補間するため）
+        """
+        self.cols["prev"][:self.n] = self.cols["pos"][:self.n]
+
+    def items(self, alpha: float = 1.0):
+        """
+        引数 alpha：remember()した位置と現在の位置の間のどこに描くか（1なら現在の位置）
+        戻り値：生きているエンティティの(画像Surface, 左上座標)を出現順に返すイテレータ
+        """
+        if self.n == 0:
+            return iter(())
+        frame = self.cols["frame"][:self.n]
+        if alpha >= 1 and self.hitbox == "frame":
+            left, top, _, _ = self.rects()
         else:
-            return b
-        
-    def n_way(self, n : int, speed : float, bullets : pg.sprite.Group, bird : Bird):
+            pos = self.cols["pos"][:self.n]
+            if alpha < 1:
+                prev = self.cols["prev"][:self.n]
+                pos = prev+(pos-prev)*alpha
+            topleft = pos.astype(int)-self.half[frame]
+            left, top = topleft[:, 0], topleft[:, 1]
+        return zip(map(self.frames.__getitem__, frame.tolist()), zip(left.tolist(), top.tolist()))
+
+
+class Entity:
+    """
+    Tableのエンティティ1体の成分の値を写し取ったもの（衝突したエンティティとして処理に渡す）
+    成分名の属性と，画像の大きさのrectを持つ
+    """
+    def __init__(self, table: Table, i: int):
         """
-        n個の弾を円状に発射する
-        引数1 n : 弾の個数
-        引数2 speed : 弾の速さ
-        引数3 bullets : 弾のGroupオブジェクト
-        引数4 bird : こうかとんクラス
+        引数1 table：エンティティのTable
+        引数2 i：エンティティの番号
         """
-        #自分から見たこうかとんの角度を計算
-        x, y = calc_orientation(self.rect, bird.rect)
-        angle0 = int(math.degrees(math.atan2(y, x)))
+        for name, arr in table.cols.items():
+            setattr(self, name, arr[i].tolist())
+        frame = getattr(self, table.hitbox)
+        w, h = table.size[frame].tolist()
+        hw, hh = table.half[frame].tolist()
+        self.rect = pg.Rect(int(self.pos[0])-hw, int(self.pos[1])-hh, w, h)
 
-        #角度の差が等しいn個のBulletオブジェクトを生成する
-        for angle in range(0+angle0, 360+angle0, 360//n):
-            bullets.add(Bullet(speed, angle, self))
-    
-    def predict(self, speed : float, bullets : pg.sprite.Group, bird : Bird):
-        """
-        こうかとんの動きを予測して弾を発射する
-        引数1 speed : 弾の速さ
-        引数2 bullets : 弾のGroupオブジェクト
-        引数3 bird : こうかとんクラス
-        """
-        pred_x, pred_y = 0, 0  #予測位置の初期化
-        bspeed_x = bird.speed*bird.sum_mv[0]  #こうかとんの速度のx成分
-        bspeed_y = bird.speed*bird.sum_mv[1]  #こうかとんの速度のy成分
-        pos_x = self.rect.centerx - bird.rect.centerx 
-        pos_y = self.rect.centery - bird.rect.centery
-        l = math.sqrt(pos_x**2 + pos_y**2)
-        v = math.sqrt(bspeed_x**2 + bspeed_y**2)
-        t1, t2 = 0, 0
-        ang1 = abs(math.degrees(math.atan2(bird.sum_mv[1], bird.sum_mv[0])))
-        ang2 = abs(math.degrees(math.atan2(pos_y, pos_x)))
-        if abs(ang1 - ang2) > 180:
-            ang = 360 - abs(ang1 - ang2)
+
+class BulletField(Table):
+    """
+    敵2とボスの弾をまとめて管理するTable
+    画像は回転アトラスから取り出し，角度番号を画像番号として持つ
+    弾の向きは整数の度で受け取り，単位ベクトルと角度番号は前もって作った表から引く
+    品質を下げると表示する角度番号(frame)だけをquantumの倍数に丸め，当たり判定は丸めない角度番号(shape)で行う
+    """
+    _rad = np.radians(np.arange(360, dtype=float))
+    unit = np.stack((np.cos(_rad), np.sin(_rad)), axis=1)  # 角度[度]→単位ベクトルの表
+    del _rad
+    hitbox = "shape"
+
+    def __init__(self, components: tuple[str, ...] = ("vel", "shape"), images=None, capacity: int = 1024):
+        """
+        引数1 components：baseの他に持つ成分名のタプル
+        引数2 images：角度番号→弾画像Surfaceのリストを返す関数（Noneならimages()）
+        引数3 capacity：最初に確保する弾の数（足りなくなったら倍にする）
+        """
+        super().__init__(components, images or self.images, capacity)
+        self.load()  # 角度の分割数を知るため
+        self.steps = len(self.frames)
+        self.angle_shape = np.rint(np.arange(360)*self.steps/360).astype(np.intp) % self.steps  # 角度[度]→丸めない角度番号の表
+        self.quantum = 1  # 新しい弾の表示する角度番号をこの倍数に丸める（大きいほど見た目の向きが粗くなる）
+
+    @property
+    def quantum(self) -> int:
+        return self._quantum
+
+    @quantum.setter
+    def quantum(self, q: int):
+        self._quantum = q
+        self.angle_frame = np.rint(np.arange(360)*self.steps/(360*q)).astype(np.intp)*q % self.steps  # 角度[度]→角度番号の表
+
+    @staticmethod
+    def images() -> list[pg.Surface]:
+        """
+        戻り値：角度番号→弾画像Surfaceのリスト
+        """
+        atlas = ASSETS.atlases.get("fig/rocket.png")
+        if atlas is None or 1.0 not in atlas.frames:
+            atlas = RotationAtlas(ASSETS.load("fig/rocket.png"), (1.0,), ATLAS_STEPS or 360)
+        frames = [atlas.frame(1.0, i).copy() for i in range(atlas.steps)]
+        for img in frames:
+            img.set_alpha(255, pg.RLEACCEL)  # 大量に描画するのでRLE圧縮して転送を速くする
+        return frames
+
+    def emit(self, xy, angles, speed):
+        """
+        弾をまとめて発射する
+        引数1 xy：発射位置（全弾共通，または弾ごとの(k, 2)の配列）
+        引数2 angles：弾の角度(度数法，整数)の配列
+        引数3 speed：弾の速さ（スカラーまたは弾ごとの配列）
+        """
+        angles = np.asarray(angles, dtype=np.intp).ravel() % 360
+        vel = self.unit[angles]*np.asarray(speed, dtype=float).reshape(-1, 1)
+        self.add(len(angles), pos=xy, vel=vel, frame=self.angle_frame[angles], shape=self.angle_shape[angles])
+
+
+class BulletPattern:
+    """
+    BULLET_PATTERNSの1行をコンパイルした弾幕パターン
+    基準の向きからの角度差[度]の表を作っておき，撃つときは1回の斉射につき基準の向きだけを求めて足す
+    弾の速度はBulletField.unitの表から引くので，弾ごとに三角関数を計算しない
+    何体分の斉射でも1回のBulletField.emitにまとめて追加する
+    """
+    shapes = {  # 形→(基準の向きの決め方，角度差の並べ方)
+        "ring": ("aim", "ring"),  # 標的の方向から全周に等間隔
+        "fan": ("aim", "fan"),  # 標的の方向を中心に扇状
+        "aimed": ("aim", "fan"),  # 標的の方向
+        "predict": ("intercept", "fan"),  # 標的の動きから求めた当たる位置の方向
+        "spiral": ("spin", "ring"),  # 撃つたびにturnずつ回る全周
+        "spray": ("random", "fan"),  # 弾ごとにでたらめな方向
+    }
+
+    def __init__(self, shape: str, n: int = 1, speed: "float|tuple[int, int]" = 5.0, spread: float = 0, turn: int = 0):
+        """
+        引数1 shape：形（shapesを参照）
+        引数2 n：1回に撃つ弾の数
+        引数3 speed：弾の速さ（(最小, 最大)なら撃つたびに整数の乱数）
+        引数4 spread：扇の広がり[度]
+        引数5 turn：渦巻きが1回ごとに回る角度[度]
+        """
+        self.base, layout = self.shapes[shape]
+        if layout == "ring":
+            offsets = np.arange(n)*360//n
         else:
-            ang = abs(ang1 - ang2)
-        
-        t1 = l / (-speed*math.sqrt(1 - ((v/speed)*math.sin(ang))**2) - v*math.cos(ang))
-        t2 = l / (speed*math.sqrt(1 - ((v/speed)*math.sin(ang))**2) - v*math.cos(ang))
-        t = self.PlusMin(t1, t2)
-        
-        pred_x = bird.rect.centerx + bspeed_x*t
-        pred_y = bird.rect.centery + bspeed_y*t
+            offsets = np.rint(np.linspace(-spread/2, spread/2, n)) if n > 1 else np.zeros(1)
+        self.offsets = offsets.astype(np.intp)  # 基準の向きからの角度差[度]
+        self.speed = speed
+        self.turn = turn
+
+    def fire(self, origins, bullets: BulletField, bird: Bird, rng: random.Random, k: int = 0):
+        """
+        パターンを1回撃つ
+        引数1 origins：発射位置（1体分の(2,)または複数体分の(m, 2)の配列）
+        引数2 bullets：弾のBulletFieldオブジェクト
+        引数3 bird：狙う対象のこうかとん
+        引数4 rng：速さやでたらめな向きを決める乱数生成器
+        引数5 k：このパターンを撃った回数（渦巻きの回転に使う）
+        """
+        origins = np.asarray(origins, dtype=float).reshape(-1, 2)
+        m, n = len(origins), len(self.offsets)
+        if isinstance(self.speed, tuple):
+            speed = np.array([rng.randint(*self.speed) for _ in range(m)], dtype=float)
+        else:
+            speed = np.full(m, float(self.speed))
+        if self.base == "aim":
+            d = np.asarray(bird.rect.center, dtype=float)-origins
+            base = np.degrees(np.arctan2(d[:, 1], d[:, 0])).astype(np.intp)[:, None]
+        elif self.base == "intercept":
+            d = intercept(origins, bird.rect.center, np.multiply(bird.speed, bird.sum_mv), speed)-origins
+            base = np.rint(np.degrees(np.arctan2(d[:, 1], d[:, 0]))).astype(np.intp)[:, None]
+        elif self.base == "spin":
+            base = np.full((m, 1), k*self.turn, dtype=np.intp)
+        else:
+            base = np.array([rng.randint(0, 359) for _ in range(m*n)], dtype=np.intp).reshape(m, n)
+        bullets.emit(np.repeat(origins, n, axis=0), base+self.offsets, np.repeat(speed, n))
 
-        x_diff, y_diff = (pred_x-self.rect.centerx), (pred_y-self.rect.centery)
-        norm = math.sqrt(x_diff**2+y_diff**2)
-        angle = int(math.degrees(math.atan2(y_diff/norm, x_diff/norm)))
-        bullets.add(Bullet(speed, angle, self))
 
+PATTERNS = {name: BulletPattern(**spec) for name, spec in BULLET_PATTERNS.items()}  # パターン名→コンパイル済みの弾幕パターン
 
-class Bullet(pg.sprite.Sprite):
+
+class World:
     """
-    弾に関するクラス
+    単純な動きのエンティティ（弾，爆弾，アイテム）を種類ごとのTableで管理するECS風のクラス
+    種類はkindsに1行足せば増やせ，移動・反射・画面外判定のシステムは持っている成分に応じて全種類に一括で働く
+    敵機やこうかとんのように個別の状態を持つものはスプライトのまま扱う
     """
-    def __init__(self, speed : float, angle : float, emy2 : Enemy2):
+    kinds = {  # 種類名→設定（table：Tableのクラス，components：baseの他に持つ成分，images：画像のリストを返す関数，
+               # snap：移動量を整数に切り捨てる（Rect.move_ipと同じ），bounce：画面端で反射する，inside：画面からはみ出したら消す）
+        "bombs": {"components": ("vel", "speed", "radius", "active"), "images": Bomb.images, "snap": True, "bounce": True},
+        "bullets": {"table": BulletField, "components": ("vel", "shape"), "images": BulletField.images, "snap": True, "inside": True},
+        "spanners": {"components": ("vel",), "images": Spanner.images, "snap": True},
+        "doubles": {"components": ("vel",), "images": Double.images, "snap": True},
+    }
+
+    def __init__(self):
+        self.tables: dict[str, Table] = {
+            kind: spec.get("table", Table)(spec["components"], spec["images"])
+            for kind, spec in self.kinds.items()
+        }
+        self.laps = {kind: f"update.{kind}" for kind in self.kinds}  # 種類名→計測の段階名
+
+    def __getitem__(self, kind: str) -> Table:
+        return self.tables[kind]
+
+    def update(self, prof: "FrameProfiler"):
         """
-        引数1 speed : 弾の速度
-        引数2 angle : 弾の角度(度数法)
-        引数3 emy2 : 弾を発射する敵のクラス
+        すべての種類のエンティティを1フレーム進める
+        引数 prof：種類ごとに処理時間を計測するFrameProfiler
         """
-        super().__init__()
-        # rad = 10
-        # self.image = pg.Surface((2*rad, 2*rad))
-        # color = (random.randint(50, 100), random.randint(100, 150), random.randint(50, 100))
-        # pg.draw.circle(self.image, color, (rad, rad), rad)
-        # self.image.set_colorkey((0, 0, 0))
-        self.image = pg.transform.rotozoom(pg.image.load(f"fig/rocket.png"), angle, 1.0)
-        self.rect = self.image.get_rect()
-        self.rect.centerx = emy2.rect.centerx
-        self.rect.centery = emy2.rect.centery
-        self.speed = speed  #弾の速度
-        self.vx = math.cos(math.radians(angle))  #速度のx成分
-        self.vy = math.sin(math.radians(angle))  #速度のy成分
+        for kind, table in self.tables.items():
+            if table.n:
+                spec = self.kinds[kind]
+                if spec.get("bounce"):
+                    self.bounce(table)
+                self.move(table, spec.get("snap", False))
+                if spec.get("inside"):
+                    self.cull(table)
+            prof.lap(self.laps[kind])
+
+    @staticmethod
+    def bounce(table: Table):
+        """
+        画面からはみ出しているエンティティの速度を反転させる
+        """
+        if pg.Rect(0, 0, WIDTH, HEIGHT).contains(table.bbox()):
+            return
+        left, top, right, bottom = table.rects()
+        vel = table["vel"]
+        out = (left < 0) | (WIDTH < right)
+        if out.any():
+            vel[out, 0] *= -1
+        out = (top < 0) | (HEIGHT < bottom)
+        if out.any():
+            vel[out, 1] *= -1
+
+    @staticmethod
+    def move(table: Table, snap: bool):
+        """
+        速度（speedの成分があれば掛けたもの）だけ位置を進める
+        引数2 snap：移動量を0の方向に整数へ切り捨てるかどうか
+        """
+        step = table["vel"]
+        if "speed" in table.cols:
+            step = step*table["speed"][:, None]
+        if snap:
+            step = np.trunc(step)
+        table["pos"] += step
+
+    @staticmethod
+    def cull(table: Table):
+        """
+        画面から少しでもはみ出したエンティティを消す
+        """
+        left, top, right, bottom = table.rects()
+        table.keep((left >= 0) & (right <= WIDTH) & (top >= 0) & (bottom <= HEIGHT))
+
+    def remember(self):
+        """
+        すべてのエンティティの現在の位置を覚えておく
+        """
+        for table in self.tables.values():
+            table.remember()
+
+
+class ParticleField:
+    """
+    爆発・火花・破片などの見た目だけの効果を管理するパーティクルシステム
+    状態は起動時に最大数分確保したNumPy配列に持ち，いくつ爆発が起きても使うメモリは変わらない
+    コマ画像は種類ごとに1組だけ作って全パーティクルで共有し，まとめて1回のblitsで描画できる
+    乱数はゲームの乱数とは別に持つので，パーティクルを出しても省いてもゲームの進行は変わらない
+    """
+    def __init__(self, seed: int = 0, capacity: int = PARTICLE_CAPACITY, budget: int = PARTICLE_BUDGET):
+        """
+        引数1 seed：飛び散る向きと速さの乱数のシード
+        引数2 capacity：同時に存在できるパーティクルの最大数
+        引数3 budget：1フレームに新しく出せるパーティクルの最大数
+        """
+        self.kinds = {kind: i for i, kind in enumerate(PARTICLES)}  # 種類名→種類番号
+        self.frames: list[pg.Surface] = []  # 全種類のコマ画像をつなげたリスト
+        offset, count = [], []
+        for spec in PARTICLES.values():
+            frames = spec["frames"]()
+            offset.append(len(self.frames))
+            count.append(len(frames))
+            self.frames += frames
+        self.offset = np.array(offset)  # 種類番号→最初のコマの画像番号
+        self.count = np.array(count)  # 種類番号→コマ数
+        self.period = np.array([spec["period"] for spec in PARTICLES.values()])
+        self.gravity = np.array([spec["gravity"] for spec in PARTICLES.values()])
+        self.half = np.array([(img.get_width()//2, img.get_height()//2) for img in self.frames])
+        self.capacity = capacity
+        self.cap = capacity  # 現在の最大数（品質の段階で下げる）
+        self.budget = budget
+        self.life_scale = 1.0  # 寿命の倍率（品質の段階で下げる）
+        self.n = 0  # 生きているパーティクルの数
+        self.pos = np.zeros((capacity, 2))  # 中心座標
+        self.vel = np.zeros((capacity, 2))  # 速度ベクトル
+        self.age = np.zeros(capacity, dtype=np.int32)  # 出てからのフレーム数
+        self.life = np.zeros(capacity, dtype=np.int32)  # 寿命
+        self.kind = np.zeros(capacity, dtype=np.intp)  # 種類番号
+        self.spawned = 0  # このフレームに出した数
+        self.dropped = 0  # 最大数・予算を超えて出さなかった数
+        self.rng = np.random.default_rng(seed)
+
+    def __len__(self) -> int:
+        return self.n
+
+    def emit(self, kind: str, xy: tuple[float, float], n: int = 1, life: int | None = None) -> int:
+        """
+        同じ位置からパーティクルをまとめて出す（最大数・1フレームの予算を超える分は出さない）
+        引数1 kind：種類名（PARTICLESを参照）
+        引数2 xy：出す位置
+        引数3 n：出す数
+        引数4 life：寿命（Noneなら種類ごとの寿命）
+        戻り値：実際に出した数
+        """
+        k = min(n, self.cap-self.n, self.budget-self.spawned)
+        if k <= 0:
+            self.dropped += n
+            return 0
+        self.dropped += n-k
+        spec = PARTICLES[kind]
+        sl = slice(self.n, self.n+k)
+        self.pos[sl] = xy
+        lo, hi = spec["speed"]
+        if hi > 0:
+            angle = self.rng.uniform(0, 2*math.pi, k)
+            speed = self.rng.uniform(lo, hi, k)
+            self.vel[sl, 0] = np.cos(angle)*speed
+            self.vel[sl, 1] = np.sin(angle)*speed
+        else:
+            self.vel[sl] = 0
+        self.age[sl] = 0
+        self.life[sl] = max(1, int((spec["life"] if life is None else life)*self.life_scale))
+        self.kind[sl] = self.kinds[kind]
+        self.n += k
+        self.spawned += k
+        return k
 
     def update(self):
         """
-        弾を速度ベクトルself.vx, self.vyに基づき移動させる
+        パーティクルを1フレーム進め，寿命を過ぎたものを消す
         """
-        self.rect.move_ip(self.speed*self.vx, self.speed*self.vy)
-        if check_bound(self.rect) != (True, True):
-            self.kill()
+        self.spawned = 0
+        n = self.n
+        if n == 0:
+            return
+        self.age[:n] += 1
+        self.vel[:n, 1] += self.gravity[self.kind[:n]]
+        self.pos[:n] += self.vel[:n]
+        alive = self.age[:n] <= self.life[:n]
+        m = int(np.count_nonzero(alive))
+        if m == n:
+            return
+        for arr in (self.pos, self.vel, self.age, self.life, self.kind):
+            arr[:m] = arr[:n][alive]
+        self.n = m
+
+    def items(self, alpha: float = 1.0):
+        """
+        引数 alpha：1つ前のupdate()からの補間の割合（1なら現在の位置）
+        戻り値：生きているパーティクルの(コマ画像Surface, 左上座標)を順に返すイテレータ
+        """
+        n = self.n
+        if n == 0:
+            return iter(())
+        kind = self.kind[:n]
+        remain = self.life[:n]-self.age[:n]
+        frame = self.offset[kind]+(remain//self.period[kind]) % self.count[kind]
+        pos = self.pos[:n] if alpha >= 1 else self.pos[:n]-self.vel[:n]*(1-alpha)
+        topleft = pos.astype(int)-self.half[frame]
+        return zip(map(self.frames.__getitem__, frame.tolist()), map(tuple, topleft.tolist()))
+
+
+class SpatialHash:
+    """
+    一様グリッドで衝突判定の候補を絞り込むクラス
+    1フレームに1度build()で作り直し，すべての衝突判定の組で共有する
+    groupcollide/spritecollideと同じ結果を同じ順序で返す
+    """
+    def __init__(self, cell: int = GRID_CELL):
+        """
+        引数 cell：1マスの大きさ
+        """
+        self.cell = cell
+        self.grids: dict[pg.sprite.AbstractGroup, dict[tuple[int, int], list]] = {}
+        self.order: dict[pg.sprite.Sprite, int] = {}  # スプライト→登録順（グループ内の順序を保つため）
+        self.seq = 0  # 次に登録するスプライトの登録順
+        self.reinserted = False  # 同じスプライトを登録し直したか（再利用されたスプライト）
 
+    def build(self, groups: list[pg.sprite.AbstractGroup]):
+        """
+        グリッドを作り直す
+        引数 groups：登録するグループのリスト
+        """
+        self.grids = {group: {} for group in groups}
+        self.order = {}
+        self.seq = 0
+        self.reinserted = False
+        for group in groups:
+            for sprite in group:
+                self.insert(sprite, group)
+
+    def insert(self, sprite: pg.sprite.Sprite, group: pg.sprite.AbstractGroup):
+        """
+        スプライトをグリッドに追加する（登録されていないグループなら何もしない）
+        引数1 sprite：追加するスプライト
+        引数2 group：スプライトが属するグループ
+        """
+        grid = self.grids.get(group)
+        if grid is None:
+            return
+        if sprite in self.order:
+            self.reinserted = True  # 古いマスにも残るので，検索時に重複を取り除く
+        self.order[sprite] = self.seq
+        self.seq += 1
+        for key in self.cells(sprite.rect):
+            cell = grid.get(key)
+            if cell is None:
+                grid[key] = [sprite]
+            else:
+                cell.append(sprite)
+
+    def cells(self, rect: pg.Rect):
+        """
+        引数 rect：対象のRect
+        戻り値：rectが重なるマスの座標を順に返すイテレータ
+        """
+        c = self.cell
+        for cx in range(rect.left//c, (rect.right-1)//c+1):
+            for cy in range(rect.top//c, (rect.bottom-1)//c+1):
+                yield cx, cy
 
-def main():
-    pg.display.set_caption("真！こうかとん無双")
-    screen = pg.display.set_mode((WIDTH, HEIGHT))
-    bg_img = pg.image.load(f"fig/pg_bg.jpg")
-    score = Score("Score", (0, 0, 255), (0, HEIGHT-50))
-
-    #こうかとんと敵に関するグループ/スプライト
-    bird = Bird(3, (900, 400))
-    life = Score("Life", (255, 0, 0), (0, HEIGHT-100))  # こうかとんの体力表示オブジェクト
-    life.value = bird.life
-    bombs = pg.sprite.Group()
-    beams = pg.sprite.Group()
-    exps = pg.sprite.Group()
-    emys = pg.sprite.Group()
-    emy2s = pg.sprite.Group()
-    bullets = pg.sprite.Group()
-    gravitys = pg.sprite.Group()
-    shields = pg.sprite.Group()
-    boss = pg.sprite.Group()
-
-    #アイテムのグループ
-    spanners = pg.sprite.Group()
-    doubles = pg.sprite.Group()
-    btime = 0
-
-    tmr = 0
-    rand = 0
-    clock = pg.time.Clock()
-    
-    while True:
+    def query(self, rect: pg.Rect, group: pg.sprite.AbstractGroup) -> list[pg.sprite.Sprite]:
+        """
+        rectと重なるgroup内のスプライトを返す
+        引数1 rect：判定するRect
+        引数2 group：相手のグループ（build()で登録済みであること）
+        戻り値：重なったスプライトのリスト（グループ内の順序）
+        """
+        grid = self.grids[group]
+        c = self.cell
+        x0, x1 = rect.left//c, (rect.right-1)//c
+        y0, y1 = rect.top//c, (rect.bottom-1)//c
+        if x0 == x1 and y0 == y1 and not self.reinserted:  # 1マスに収まるときは重複の心配がない
+            return [
+                sprite for sprite in grid.get((x0, y0), ())
+                if rect.colliderect(sprite.rect) and group.has(sprite)
+            ]
+        found = set()
+        for cx in range(x0, x1+1):
+            for cy in range(y0, y1+1):
+                for sprite in grid.get((cx, cy), ()):
+                    if sprite not in found and rect.colliderect(sprite.rect) and group.has(sprite):
+                        found.add(sprite)
+        if len(found) < 2:
+            return list(found)
+        return sorted(found, key=self.order.__getitem__)
+
+    def spritecollide(self, sprite: pg.sprite.Sprite, group: pg.sprite.AbstractGroup,
+                      dokill: bool) -> list[pg.sprite.Sprite]:
+        """
+        pg.sprite.spritecollideと同じ判定をグリッドを使って行う
+        """
+        hits = self.query(sprite.rect, group)
+        if dokill:
+            for hit in hits:
+                hit.kill()
+        return hits
+
+    def groupcollide(self, groupa: pg.sprite.AbstractGroup, groupb: pg.sprite.AbstractGroup,
+                     dokilla: bool, dokillb: bool) -> dict:
+        """
+        pg.sprite.groupcollideと同じ判定をグリッドを使って行う
+        """
+        crashed = {}
+        for sprite in groupa.sprites():
+            hits = self.spritecollide(sprite, groupb, dokillb)
+            if hits:
+                crashed[sprite] = hits
+                if dokilla:
+                    sprite.kill()
+        return crashed
 
-        #こうかとんの操作に関する処理
+
+class Collision:
+    """
+    衝突判定表の1行に関するクラス
+    """
+    def __init__(self, a: str, b: str, kill_a: bool, kill_b: bool, handler: str | None = None):
+        """
+        引数1 a：判定する側のGameStateの属性名（"bird"ならこうかとん1体）
+        引数2 b：判定される側のグループの属性名
+        引数3 kill_a：衝突したaを消すかどうか
+        引数4 kill_b：衝突したbを消すかどうか
+        引数5 handler：衝突したaと相手のリストを受け取るGameStateのメソッド名
+        """
+        self.a = a
+        self.b = b
+        self.kill_a = kill_a
+        self.kill_b = kill_b
+        self.handler = handler
+
+
+class Inputs:
+    """
+    1フレーム分のプレイヤー入力に関するクラス
+    """
+    def __init__(self, held=(), pressed=(), quit: bool = False):
+        """
+        引数1 held：押下中のキーの集まり
+        引数2 pressed：このフレームで新たに押されたキー（KEYDOWN）の集まり
+        引数3 quit：ウィンドウが閉じられたかどうか
+        """
+        self.held = frozenset(held)
+        self.pressed = frozenset(pressed)
+        self.quit = quit
+
+    def __getitem__(self, key: int) -> bool:
+        return key in self.held
+
+    @classmethod
+    def from_pygame(cls, extra_keys: tuple[int, ...] = ()) -> "Inputs":
+        """
+        pygameのキー状態とイベントキューから入力を読み取る
+        引数 extra_keys：INPUT_KEYSの他にKEYDOWNを拾うキー（ゲーム外の操作用）
+        戻り値：Inputsオブジェクト
+        """
         key_lst = pg.key.get_pressed()
-        mode = 0
-        if key_lst[pg.K_LSHIFT]:
-            mode = 1
+        held = [k for k in INPUT_KEYS if key_lst[k]]
+        pressed, quit = [], False
         for event in pg.event.get():
             if event.type == pg.QUIT:
-                return 0
-            #ビーム
-            if event.type == pg.KEYDOWN and event.key == pg.K_SPACE:
-                
-                if btime > 0: 
-                    if not mode:
-                        beams.add(Beam(bird,a=4))
-                        btime -= 1
+                quit = True
+            if event.type == pg.KEYDOWN and (event.key in INPUT_KEYS or event.key in extra_keys):
+                pressed.append(event.key)
+        return cls(held, pressed, quit)
+
+
+class InputLog:
+    """
+    乱数のシードと各フレームの入力を記録したリプレイに関するクラス
+    入力はINPUT_KEYSの押下中(下位16ビット)と新たな押下(上位16ビット)を1フレーム32ビットにまとめ，
+    zlibで圧縮してファイルに書き出す
+    """
+    MAGIC = b"MKRP"
+    VERSION = 1
+    HEADER = struct.Struct("<4sBQIqB")  # 識別子，版，シード，フレーム数，スコア，ゲームオーバーか
+
+    def __init__(self, seed: int, frames: list[int] | None = None):
+        """
+        引数1 seed：乱数のシード
+        引数2 frames：フレームごとの入力のビット列のリスト
+        """
+        self.seed = seed
+        self.frames = frames if frames is not None else []
+        self.score = None  # 記録を終えたときのスコア
+        self.over = None  # 記録を終えたときにゲームオーバーだったか
+
+    def __len__(self) -> int:
+        return len(self.frames)
+
+    @staticmethod
+    def encode(inputs: Inputs) -> int:
+        """
+        引数 inputs：1フレーム分の入力
+        戻り値：入力をまとめたビット列
+        """
+        bits = 0
+        for i, key in enumerate(INPUT_KEYS):
+            if key in inputs.held:
+                bits |= 1 << i
+            if key in inputs.pressed:
+                bits |= 1 << (16+i)
+        return bits
+
+    @staticmethod
+    def decode(bits: int) -> Inputs:
+        """
+        引数 bits：encode()で作ったビット列
+        戻り値：Inputsオブジェクト
+        """
+        held = [key for i, key in enumerate(INPUT_KEYS) if bits >> i & 1]
+        pressed = [key for i, key in enumerate(INPUT_KEYS) if bits >> (16+i) & 1]
+        return Inputs(held, pressed)
+
+    def record(self, inputs: Inputs):
+        """
+        1フレーム分の入力を追加する
+        引数 inputs：GameState.step()に渡した入力
+        """
+        self.frames.append(self.encode(inputs))
+
+    def finish(self, state: "GameState"):
+        """
+        記録を終えたときの結果を保存する（リプレイの照合に使う）
+        引数 state：記録したGameState
+        """
+        self.score = state.score.value
+        self.over = state.over
+
+    def inputs(self):
+        """
+        戻り値：フレームごとのInputsを順に返すイテレータ（同じ入力のInputsは共有する）
+        """
+        cache: dict[int, Inputs] = {}
+        for bits in self.frames:
+            inputs = cache.get(bits)
+            if inputs is None:
+                inputs = cache[bits] = self.decode(bits)
+            yield inputs
+
+    def save(self, path: str):
+        """
+        ファイルに書き出す
+        引数 path：書き出すファイルのパス
+        """
+        score = self.score if self.score is not None else -1
+        header = self.HEADER.pack(self.MAGIC, self.VERSION, self.seed, len(self.frames), score, bool(self.over))
+        with open(path, "wb") as f:
+            f.write(header)
+            f.write(zlib.compress(np.asarray(self.frames, dtype="<u4").tobytes(), 9))
+
+    @classmethod
+    def load(cls, path: str) -> "InputLog":
+        """
+        ファイルから読み込む
+        引数 path：読み込むファイルのパス
+        戻り値：InputLogオブジェクト
+        """
+        with open(path, "rb") as f:
+            data = f.read()
+        magic, version, seed, ticks, score, over = cls.HEADER.unpack_from(data)
+        if magic != cls.MAGIC or version != cls.VERSION:
+            raise ValueError(f"{path}はリプレイファイルではありません")
+        frames = np.frombuffer(zlib.decompress(data[cls.HEADER.size:]), dtype="<u4")
+        if len(frames) != ticks:
+            raise ValueError(f"{path}のフレーム数が一致しません")
+        log = cls(seed, frames.tolist())
+        log.score = score if score >= 0 else None
+        log.over = bool(over)
+        return log
+
+
+class Snapshot:
+    """
+    GameStateの全状態を1つのバイト列にまとめ，そこから戻すクラス
+    Worldの成分の配列，スプライトの属性，予約中のイベント，スコア・体力・強化ビームの残り回数・フレーム番号，
+    乱数の状態を含み，戻した状態から同じ入力で進めれば元と全く同じに進む
+    大きさの変わらない部分（ヘッダ，乱数，こうかとん），Worldの成分ごとの配列，数の変わる部分（スプライト，
+    イベント，パーティクル）の順に並べる
+    描画の補間用の位置，Lifecycleのエンティティ数の記録，Schedulerの発火数は含めない
+    """
+    MAGIC = 0x4D4B5353  # "MKSS"
+    VERSION = 2  # 2：弾のTableにshapeの成分を追加
+    sprites = {  # スプライトのグループ名→クラス（保存する属性はクラスのsavedに書く）
+        "beams": Beam, "emys": Enemy, "emy2s": Enemy2, "gravitys": Gravity, "shields": Shield, "boss": BOSS,
+    }
+    symbols = (  # 保存できる文字列（状態名，画像のパス，イベントの段階名と関数名，パターン名．変えたらVERSIONを上げる）
+        "down", "stop", "move", "normal", "hyper",
+        "spawn", "drop", "update", "spawn_wave", "drop_bomb", "fire", "kill",
+        *Enemy.imgs, *PATTERNS,
+    )
+    codes = {symbol: i for i, symbol in enumerate(symbols)}  # 文字列→番号
+    layouts = {  # グループ名→(数値の属性名，その型，文字列の属性名)（記録の列はRectの4つ，born，idleの後にこの順に並ぶ）
+        name: (
+            tuple(attr for attr, kind in cls.saved.items() if kind != "s"),
+            tuple(kind for kind in cls.saved.values() if kind != "s"),
+            tuple(attr for attr, kind in cls.saved.items() if kind == "s"),
+        )
+        for name, cls in sprites.items()
+    }
+    patterns = {pattern: name for name, pattern in PATTERNS.items()}  # BulletPattern→パターン名
+
+    @classmethod
+    def capture(cls, state: "GameState") -> bytes:
+        """
+        引数 state：GameState
+        戻り値：状態をまとめたバイト列
+        """
+        codes = cls.codes
+        bird, particles, tables = state.bird, state.particles, list(state.world.tables.values())
+
+        #スプライトは1グループ1つの表にし，イベントからはグループ番号と表の行番号で参照する
+        refs: dict[pg.sprite.Sprite, int] = {}
+        records = []
+        for gi, (name, (numeric, _, symbolic)) in enumerate(cls.layouts.items()):
+            group = getattr(state, name)
+            born, idle = state.lifecycle.born.get(name, {}), state.lifecycle.idle.get(name, {})
+            rows = []
+            for j, sprite in enumerate(group):
+                refs[sprite] = gi << 32 | j
+                rows.append((
+                    *sprite.rect, born.get(sprite, -1), idle.get(sprite, -1),
+                    *[getattr(sprite, attr) for attr in numeric], *[codes[getattr(sprite, attr)] for attr in symbolic],
+                ))
+            records.append(np.array(rows, dtype=np.float64).reshape(len(rows), 6+len(numeric)+len(symbolic)))
+
+        #予約中のイベント：段階，フレーム番号，呼び出す相手（-1ならGameState），関数名，引数の数，(種類, 値)×引数の数
+        #（消えたスプライトのイベントは呼んでも何もしないので保存しない）
+        timers = []
+        for phase, slots in sorted(state.sched.slots.items()):
+            for tick in sorted(slots):  # 同じ状態が同じバイト列になるように並べる
+                for timer in slots[tick]:
+                    if timer.fn is None:
+                        continue
+                    owner = timer.fn.__self__
+                    if owner is not state and owner not in refs:
+                        continue
+                    words = [codes[phase], tick, -1 if owner is state else refs[owner], codes[timer.fn.__name__],
+                             len(timer.args)]
+                    for arg in timer.args:
+                        if isinstance(arg, pg.sprite.Sprite):
+                            if arg not in refs:
+                                break
+                            words += (1, refs[arg])
+                        elif isinstance(arg, BulletPattern):
+                            words += (2, codes[cls.patterns[arg]])
+                        else:
+                            words += (0, int(arg))
                     else:
-                        neobeam = NeoBeam(bird, 7,b=4)
-                        for beam in neobeam.gen_beams():
-                            beams.add(beam)
-                        btime -= 1
+                        timers += words
+
+        n = particles.n
+        head = np.array([
+            cls.MAGIC, cls.VERSION, state.seed, state.tmr, state.level, state.btime, state.score.value,
+            state.over, state.damaged, particles.dropped, n, len(timers),
+            *[table.n for table in tables], *[len(r) for r in records],
+        ], dtype=np.int64)
+        version, mt, gauss = state.rng.getstate()
+        pcg = particles.rng.bit_generator.state
+        mask = (1 << 64)-1
+        seeds = np.array([
+            pcg["state"]["state"] & mask, pcg["state"]["state"] >> 64, pcg["state"]["inc"] & mask, pcg["state"]["inc"] >> 64,
+            pcg["has_uint32"], pcg["uinteger"],
+        ], dtype=np.uint64)
+        pose = (1, *bird.pose) if isinstance(bird.pose, tuple) else (0, bird.pose, 0)
+        sum_mv = getattr(bird, "sum_mv", None)
+        floats = np.array([
+            *bird.rect, *bird.dire, *pose, codes[bird.state], bird.hyper_life, bird.damaged_life, bird.life, bird.speed,
+            sum_mv is not None, *(sum_mv or (0, 0)),
+            math.nan if gauss is None else gauss,
+            *[v for overlay in state.overlays.overlays.values() for v in (overlay.level, overlay.target)],
+        ], dtype=np.float64)
+        fixed = b"".join((head, np.fromiter(mt, np.uint32, len(mt)), seeds, floats))
+        columns = [col[:table.n].tobytes() for table in tables for name, col in table.cols.items() if name != "prev"]
+        tail = b"".join((
+            *records, np.array(timers, dtype=np.int64),
+            particles.pos[:n], particles.vel[:n], particles.age[:n], particles.life[:n], particles.kind[:n],
+        ))
+        return b"".join((fixed, *columns, tail))
+
+    @classmethod
+    def restore(cls, state: "GameState", data: bytes):
+        """
+        capture()で作ったバイト列の状態に戻す
+        引数1 state：戻す先のGameState
+        引数2 data：capture()の戻り値
+        """
+        offset = 0
+
+        def take(dtype, count: int, shape: tuple = ()) -> np.ndarray:
+            nonlocal offset
+            arr = np.frombuffer(data, dtype, count*math.prod(shape) if shape else count, offset)
+            offset += arr.nbytes
+            return arr.reshape((count,)+shape) if shape else arr
+
+        symbols = cls.symbols
+        tables = list(state.world.tables.values())
+        groups = [getattr(state, name) for name in cls.layouts]
+        size = 12+len(tables)+len(groups)
+        head = take(np.int64, size).tolist()
+        if head[:2] != [cls.MAGIC, cls.VERSION]:
+            raise ValueError("スナップショットではないか，版が違います")
+        seed, tmr, level, btime, score, over, damaged, dropped, n, ntimers = head[2:12]
+        sizes = head[12:12+len(tables)]
+        counts = head[12+len(tables):]
+        state.seed, state.tmr, state.level, state.btime, state.score.value = seed, tmr, level, btime, score
+        state.over, state.damaged = bool(over), bool(damaged)
+
+        mt = take(np.uint32, 625)
+        seeds = take(np.uint64, 6).tolist()
+        nfloats = 18+2*len(state.overlays.overlays)
+        floats = take(np.float64, nfloats).tolist()
+        gauss = floats[17]
+        state.rng.setstate((3, tuple(mt.tolist()), None if math.isnan(gauss) else gauss))
+        particles = state.particles
+        particles.rng.bit_generator.state = {
+            "bit_generator": "PCG64",
+            "state": {"state": seeds[0] | seeds[1] << 64, "inc": seeds[2] | seeds[3] << 64},
+            "has_uint32": seeds[4], "uinteger": seeds[5],
+        }
+
+        bird = state.bird
+        x, y, w, h, dx, dy, is_dire, p0, p1, code, hyper_life, damaged_life, life, speed, moved, mx, my = map(int, floats[:17])
+        bird.rect = pg.Rect(x, y, w, h)
+        bird.dire = dx, dy
+        bird.pose = (p0, p1) if is_dire else p0
+        bird.state = symbols[code]
+        bird.hyper_life, bird.damaged_life, bird.life, bird.speed = hyper_life, damaged_life, life, speed
+        if moved:
+            bird.sum_mv = [mx, my]
+        bird.refresh()
+        state.life.value = bird.life
+        for i, overlay in enumerate(state.overlays.overlays.values()):
+            overlay.level, overlay.target = floats[18+2*i], floats[19+2*i]
+            overlay.target = int(overlay.target)
+
+        for table, k in zip(tables, sizes):
+            if k > len(table.cols["pos"]):
+                table.reserve(k)
+            for name, col in table.cols.items():
+                if name != "prev":
+                    col[:k] = take(col.dtype, k, col.shape[1:])
+            table.n = k
+            table.cols["prev"][:k] = table.cols["pos"][:k]
+            table.bounds = table.box = None
+            if k and table.frames is None:
+                table.load()
+
+        #スプライトを作り直す（プールするクラスはプールから取り出す）
+        sprites = []
+        for (name, (numeric, kinds, symbolic)), group, count in zip(cls.layouts.items(), groups, counts):
+            sprite_cls = cls.sprites[name]
+            for sprite in list(group):
+                sprite.kill()
+            rows = take(np.float64, count, (6+len(numeric)+len(symbolic),))
+            columns = [rows[:, i].astype(np.int64).tolist() for i in range(6)]
+            for i, kind in enumerate(kinds, 6):
+                col = rows[:, i]
+                if kind == "i":
+                    columns.append(col.astype(np.int64).tolist())
+                elif kind == "n":
+                    columns.append([int(v) if math.isfinite(v) else v for v in col.tolist()])
                 else:
-                    if not mode:
-                        beams.add(Beam(bird))
-                    else:
-                        neobeam = NeoBeam(bird, 7,b=2)
-                        for beam in neobeam.gen_beams():
-                            beams.add(beam)
-            #EMP
-            if event.type == pg.KEYDOWN and event.key == pg.K_e:
-                if score.value > 20:
-                    EMP(emys, bombs, screen)
-                    score.value-=20
-            #重力場
-            if event.type == pg.KEYDOWN and event.key == pg.K_RETURN:
-                if score.value >= 200:
-                    score.value -= 200
-                    gravitys.add(Gravity(50))
-            #防御壁
-            if event.type == pg.KEYDOWN and event.key == pg.K_v:
-                if score.value >= 50 and len(shields) == 0:
-                    score.value -= 50
-                    shields.add(Shield(bird, 400))
-        screen.blit(bg_img, [0, 0])
-
-        #敵の出現処理
+                    columns.append(col.tolist())
+            for i in range(6+len(numeric), rows.shape[1]):
+                columns.append([symbols[v] for v in rows[:, i].astype(np.int64).tolist()])
+            born, idle = {}, {}
+            members = []
+            for x, y, w, h, t0, t1, *values in zip(*columns):
+                if issubclass(sprite_cls, PooledSprite):
+                    sprite = sprite_cls.pool.revive()
+                else:
+                    sprite = sprite_cls.__new__(sprite_cls)
+                    pg.sprite.Sprite.__init__(sprite)
+                sprite.__dict__.update(zip(numeric+symbolic, values))
+                sprite.rect = pg.Rect(x, y, w, h)
+                if hasattr(sprite, "redraw"):
+                    sprite.redraw()
+                if t0 >= 0:
+                    born[sprite] = t0
+                if t1 >= 0:
+                    idle[sprite] = t1
+                members.append(sprite)
+            group.add(*members)
+            sprites.append(members)
+            if name in state.lifecycle.born:
+                state.lifecycle.born[name], state.lifecycle.idle[name] = born, idle
+
+        def resolve(ref: int):
+            return sprites[ref >> 32][ref & 0xFFFFFFFF]
+
+        state.sched.slots = {}
+        state.wave_timers = [None]*len(state.waves)
+        words = take(np.int64, ntimers).tolist()
+        i = 0
+        while i < len(words):
+            phase, tick, owner, fn, nargs = words[i:i+5]
+            args = []
+            for tag, value in zip(words[i+5:i+5+2*nargs:2], words[i+6:i+6+2*nargs:2]):
+                args.append(value if tag == 0 else resolve(value) if tag == 1 else PATTERNS[symbols[value]])
+            i += 5+2*nargs
+            owner = state if owner == -1 else resolve(owner)
+            timer = state.sched.at(tick, symbols[phase], getattr(owner, symbols[fn]), *args)
+            if owner is state and symbols[fn] == "spawn_wave":
+                state.wave_timers[args[0]] = timer
+
+        particles.n = n
+        particles.dropped = dropped
+        particles.pos[:n] = take(np.float64, n, (2,))
+        particles.vel[:n] = take(np.float64, n, (2,))
+        particles.age[:n] = take(particles.age.dtype, n)
+        particles.life[:n] = take(particles.life.dtype, n)
+        particles.kind[:n] = take(particles.kind.dtype, n)
+        state.prev = {}
+
+
+class Rewind:
+    """
+    巻き戻しのために直近framesフレーム分の状態を持つクラス
+    keyframeフレームごとに完全なスナップショット（キーフレーム）を撮り，その間は各フレームの入力だけを持つ
+    GameStateは同じ状態から同じ入力で進めれば全く同じに進むので，あるフレームへ戻すときは
+    それ以前で最も新しいキーフレームに戻してから，持っている入力で進め直す
+    """
+    MAGIC = b"MKRW"
+    VERSION = 2  # 2：差分のリングバッファをやめ，キーフレームと入力だけを持つ
+    HEADER = struct.Struct("<4sBII")  # 識別子，版，キーフレームの数，入力の数
+    KEY = struct.Struct("<qI")  # フレーム番号，スナップショットのバイト数
+    INPUT = np.dtype([("tmr", "<i8"), ("bits", "<u4")])  # 進める前のフレーム番号，InputLog.encode()した入力
+
+    def __init__(self, frames: int = REWIND_FRAMES, keyframe: int = REWIND_KEYFRAME):
+        """
+        引数1 frames：戻せるようにしておくフレーム数
+        引数2 keyframe：キーフレームを撮る間隔[フレーム]
+        """
+        self.frames = frames
+        self.keyframe = keyframe
+        self.keys: deque[tuple[int, bytes]] = deque()  # (フレーム番号，スナップショット)（古い順）
+        self.inputs: deque[tuple[int, int]] = deque()  # (進める前のフレーム番号，入力のビット列)（古い順）
+
+    def __len__(self) -> int:
+        """
+        戻り値：戻せるフレームの数
+        """
+        return self.last()-self.first() if self.keys else 0
+
+    def first(self) -> int:
+        """
+        戻り値：戻せる最も古いフレーム番号
+        """
+        return self.keys[0][0]
+
+    def last(self) -> int:
+        """
+        戻り値：記録した入力で進め直せる最も新しいフレーム番号
+        """
+        return max(self.keys[-1][0], self.inputs[-1][0]+1 if self.inputs else 0)
+
+    def push(self, state: "GameState", inputs: Inputs):
+        """
+        これから進める1フレーム分を記録する（step()の前に呼ぶ）
+        前のキーフレームからkeyframeフレーム経っていれば今の状態のスナップショットも撮り，
+        framesフレームより前にしか戻れないキーフレームとその入力を捨てる
+        引数1 state：GameState
+        引数2 inputs：stateのstep()に渡す入力
+        """
+        if not self.keys or state.tmr-self.keys[-1][0] >= self.keyframe:
+            self.keys.append((state.tmr, Snapshot.capture(state)))
+            while len(self.keys) > 1 and self.keys[1][0] <= state.tmr-self.frames:
+                self.keys.popleft()
+            while self.inputs and self.inputs[0][0] < self.keys[0][0]:
+                self.inputs.popleft()
+        self.inputs.append((state.tmr, InputLog.encode(inputs)))
+
+    def restore(self, state: "GameState", tmr: int) -> int:
+        """
+        tmr以前で最も新しいキーフレームに戻し，記録した入力でtmrまで進め直す
+        引数1 state：戻す先のGameState
+        引数2 tmr：フレーム番号（記録より新しければ記録の最後まで）
+        戻り値：戻したフレーム番号
+        """
+        key = self.keys[0]
+        for entry in self.keys:
+            if entry[0] <= tmr:
+                key = entry
+        state.restore(key[1])
+        for t, bits in self.inputs:
+            if state.tmr >= tmr or state.over:
+                break
+            if t >= state.tmr:
+                state.step(InputLog.decode(bits))
+        return state.tmr
+
+    def rewind(self, state: "GameState", ticks: int) -> int:
+        """
+        ticksフレーム前の状態に戻し，それより新しいキーフレームと入力を捨てる
+        引数1 state：戻すGameState
+        引数2 ticks：戻すフレーム数
+        戻り値：戻したフレーム番号
+        """
+        if not self.keys:
+            return state.tmr
+        tmr = self.restore(state, max(state.tmr-ticks, self.first()))
+        while self.keys[-1][0] > tmr:
+            self.keys.pop()
+        while self.inputs and self.inputs[-1][0] >= tmr:
+            self.inputs.pop()
+        return tmr
+
+    def save(self, path: str):
+        """
+        持っているキーフレームと入力をzlibで圧縮してファイルに書き出す
+        引数 path：書き出すファイルのパス
+        """
+        chunks = []
+        for tmr, data in self.keys:
+            chunks += [self.KEY.pack(tmr, len(data)), data]
+        chunks.append(np.array(self.inputs, dtype=self.INPUT).tobytes())
+        with open(path, "wb") as f:
+            f.write(self.HEADER.pack(self.MAGIC, self.VERSION, len(self.keys), len(self.inputs)))
+            f.write(zlib.compress(b"".join(chunks), 1))
+
+    @classmethod
+    def load(cls, path: str) -> "Rewind":
+        """
+        ファイルから読み込む
+        引数 path：読み込むファイルのパス
+        戻り値：Rewindオブジェクト（restore()で好きなフレームから再開できる）
+        """
+        with open(path, "rb") as f:
+            data = f.read()
+        magic, version, nkeys, ninputs = cls.HEADER.unpack_from(data)
+        if magic != cls.MAGIC or version != cls.VERSION:
+            raise ValueError(f"{path}は巻き戻し用のスナップショットのファイルではありません")
+        body = zlib.decompress(data[cls.HEADER.size:])
+        offset = 0
+        keys = []
+        for _ in range(nkeys):
+            tmr, size = cls.KEY.unpack_from(body, offset)
+            offset += cls.KEY.size
+            keys.append((tmr, body[offset:offset+size]))
+            offset += size
+        inputs = np.frombuffer(body, cls.INPUT, ninputs, offset)
+        rewind = cls(keys[-1][0]-keys[0][0]+len(inputs) if keys else 0)
+        rewind.keys.extend(keys)
+        rewind.inputs.extend(zip(inputs["tmr"].tolist(), inputs["bits"].tolist()))
+        return rewind
+
+
+class Timer:
+    """
+    Schedulerに予約したイベントに関するクラス
+    """
+    __slots__ = ("fn", "args")
+
+    def __init__(self, fn, args: tuple):
+        self.fn = fn
+        self.args = args
+
+    def cancel(self):
+        """
+        イベントを取り消す
+        """
+        self.fn = None
+
+
+class Scheduler:
+    """
+    フレーム番号ごとのバケツにイベントを予約するタイマーホイール
+    バケツはフレーム番号をキーとする辞書なので，1フレームの処理は
+    その時刻に発火するイベントの数だけに比例し，生きているエンティティの数には依存しない
+    イベントは処理段階(phase)ごとに分かれ，同じ時刻・段階では予約した順に発火する
+    """
+    def __init__(self):
+        self.slots: dict[str, dict[int, list[Timer]]] = {}  # 段階→フレーム番号→イベントのリスト
+        self.fired = 0  # 発火したイベントの総数
+
+    def at(self, tick: int, phase: str, fn, *args) -> Timer:
+        """
+        イベントを予約する
+        引数1 tick：発火させるフレーム番号
+        引数2 phase：発火させる処理段階
+        引数3 fn：呼び出す関数（残りの引数を渡す）
+        戻り値：予約したTimer（cancel()で取り消せる）
+        """
+        timer = Timer(fn, args)
+        slots = self.slots.setdefault(phase, {})
+        bucket = slots.get(tick)
+        if bucket is None:
+            slots[tick] = [timer]
+        else:
+            bucket.append(timer)
+        return timer
+
+    def run(self, tick: int, phase: str):
+        """
+        時刻tick・段階phaseに予約されたイベントを発火させる
+        発火中に同じ時刻・段階へ予約されたイベントも続けて発火させる
+        引数1 tick：現在のフレーム番号
+        引数2 phase：処理段階
+        """
+        slots = self.slots.get(phase)
+        if not slots:
+            return
+        while (bucket := slots.pop(tick, None)):
+            for timer in bucket:
+                if timer.fn is not None:
+                    self.fired += 1
+                    timer.fn(*timer.args)
+
+    def pending(self) -> int:
+        """
+        戻り値：予約中（取り消されていない）のイベントの数
+        """
+        return sum(
+            timer.fn is not None
+            for slots in self.slots.values() for bucket in slots.values() for timer in bucket
+        )
+
+
+class Lifecycle:
+    """
+    エンティティの寿命を管理するクラス
+    グループごとの規則に従って寿命切れ・画面外のスプライトを消し，最大数を超えた分を追い出す
+    また，グループの数が増え続けていないかを監視して警告する
+    """
+    def __init__(self, rules: dict[str, dict] = LIFECYCLE_RULES):
+        """
+        引数 rules：グループ名→規則の辞書（LIFECYCLE_RULESを参照）
+        """
+        self.rules = rules
+        self.born: dict[str, dict[pg.sprite.Sprite, int]] = {name: {} for name in rules}  # 出現したフレーム
+        self.idle: dict[str, dict[pg.sprite.Sprite, int]] = {name: {} for name in rules}  # idleになったフレーム
+        self.history: dict[str, deque] = {}  # グループ名→エンティティ数の記録
+        self.removed: dict[str, int] = dict.fromkeys(rules, 0)  # 規則によって消した数
+        self.leaking: set[str] = set()  # 警告済みのグループ
+
+    @staticmethod
+    def uncapped(rules: dict[str, dict] = LIFECYCLE_RULES) -> dict[str, dict]:
+        """
+        最大数による追い出しだけを外した規則を作る（大量のエンティティを並べて計測するとき用）
+        引数 rules：グループ名→規則の辞書
+        戻り値：capを除いた規則の辞書
+        """
+        return {name: {key: v for key, v in rule.items() if key != "cap"} for name, rule in rules.items()}
+
+    def update(self, state: "GameState"):
+        """
+        規則を適用し，一定間隔でエンティティ数を記録する
+        引数 state：対象のGameState
+        """
+        tmr = state.tmr
+        screen_rect = pg.Rect(0, 0, WIDTH, HEIGHT)
+        for name, rule in self.rules.items():
+            group = getattr(state, name)
+            if isinstance(group, Table):
+                self.removed[name] += self.expire(group, rule, tmr)
+                continue
+            old_born, old_idle = self.born[name], self.idle[name]
+            born, idle = {}, {}
+            expired = []
+            ttl, idle_ttl = rule.get("ttl"), rule.get("idle_ttl")
+            is_idle, offscreen = rule.get("idle"), rule.get("offscreen", False)
+            for sprite in group:
+                born[sprite] = t0 = old_born.get(sprite, tmr)
+                if ttl is not None and tmr-t0 >= ttl:
+                    expired.append(sprite)
+                elif offscreen and not screen_rect.colliderect(sprite.rect):
+                    expired.append(sprite)
+                elif is_idle is not None and is_idle(sprite):
+                    idle[sprite] = t1 = old_idle.get(sprite, tmr)
+                    if tmr-t1 >= idle_ttl:
+                        expired.append(sprite)
+            cap = rule.get("cap")
+            if cap is not None and len(group)-len(expired) > cap:
+                dead = set(expired)
+                alive = [sprite for sprite in group if sprite not in dead]
+                alive.sort(key=born.__getitem__)  # 古い順
+                excess = len(alive)-cap
+                expired += alive[:excess] if rule.get("evict", "oldest") == "oldest" else alive[-excess:]
+            for sprite in expired:
+                sprite.kill()
+                born.pop(sprite, None)
+                idle.pop(sprite, None)
+            self.removed[name] += len(expired)
+            self.born[name], self.idle[name] = born, idle
+        if tmr % LEAK_SAMPLE == 0:
+            self.sample(state.counts())
+
+    @staticmethod
+    def expire(table: "Table", rule: dict, tmr: int) -> int:
+        """
+        Worldの種類に規則を一括で適用する（出現・無力化のフレームはTableのborn，idleの成分に持つ）
+        引数1 table：対象のTable
+        引数2 rule：寿命の規則
+        引数3 tmr：現在のフレーム番号
+        戻り値：消したエンティティの数
+        """
+        n = len(table)
+        if n == 0:
+            return 0
+        born = table["born"]
+        if born[-1] < 0:  # 新しいエンティティは末尾にある
+            born[born < 0] = tmr
+        expired = np.zeros(n, dtype=bool)
+        ttl, is_idle = rule.get("ttl"), rule.get("idle")
+        if ttl is not None and tmr-born[0] >= ttl:  # 出現順に並んでいるので先頭が最も古い
+            expired |= tmr-born >= ttl
+        if rule.get("offscreen", False) and not pg.Rect(0, 0, WIDTH, HEIGHT).contains(table.bbox()):
+            left, top, right, bottom = table.rects()
+            expired |= (left >= WIDTH) | (right <= 0) | (top >= HEIGHT) | (bottom <= 0)
+        if is_idle is not None:
+            mask = np.asarray(is_idle(table), dtype=bool)
+            since = table["idle"]
+            if mask.any():
+                since[:] = np.where(mask, np.where(since < 0, tmr, since), -1)
+                expired |= mask & (tmr-since >= rule["idle_ttl"])
+            else:
+                since[:] = -1
+        cap = rule.get("cap")
+        if cap is not None and n > cap:
+            alive = np.flatnonzero(~expired)
+            excess = len(alive)-cap
+            if excess > 0:
+                expired[alive[:excess] if rule.get("evict", "oldest") == "oldest" else alive[-excess:]] = True
+        removed = int(np.count_nonzero(expired))
+        if removed:
+            table.keep(~expired)
+        return removed
+
+    def sample(self, counts: dict[str, int]):
+        """
+        エンティティ数を記録し，増え続けているグループがあれば警告する
+        引数 counts：グループ名→エンティティ数の辞書
+        """
+        for name, n in counts.items():
+            ring = self.history.get(name)
+            if ring is None:
+                ring = self.history[name] = deque(maxlen=LEAK_WINDOW)
+            ring.append(n)
+            slope = self.slope(name)
+            if slope >= LEAK_SLOPE and name not in self.leaking:
+                self.leaking.add(name)
+                warnings.warn(
+                    f"{name}の数が増え続けている（{slope:.1f}個/1000フレーム，現在{n}個）",
+                    RuntimeWarning, stacklevel=2,
+                )
+            elif slope < LEAK_SLOPE/2:
+                self.leaking.discard(name)
+
+    def slope(self, name: str) -> float:
+        """
+        引数 name：グループ名
+        戻り値：記録したエンティティ数の傾き[個/1000フレーム]（記録が揃うまでは0）
+        """
+        ring = self.history.get(name)
+        if ring is None or len(ring) < LEAK_WINDOW:
+            return 0.0
+        return float(np.polyfit(np.arange(len(ring)), np.array(ring, dtype=float), 1)[0])*1000/LEAK_SAMPLE
+
+    def report(self) -> dict[str, dict]:
+        """
+        戻り値：グループ名→(現在数，傾き，規則で消した数，警告中か)の辞書
+        """
+        return {
+            name: {
+                "count": ring[-1],
+                "slope_per_1000": self.slope(name),
+                "removed": self.removed.get(name, 0),
+                "leaking": name in self.leaking,
+            }
+            for name, ring in self.history.items()
+        }
+
+
+class FrameProfiler:
+    """
+    1フレームを処理段階ごとに計測するクラス
+    lap()を呼ぶたびに前回からの経過時間[ns]をその段階に加算し，
+    end_frame()で直近PROFILE_FRAMESフレーム分のリングバッファに積む
+    CSVは1行に(フレーム番号，種類，名前，値)を書く縦長の形にし，フレームごとに段階や数の項目が変わっても落とさない
+    （種類は段階なら"phase"で値は経過時間[ns]，数なら"count"）
+    """
+    def __init__(self, enabled: bool = True, size: int = PROFILE_FRAMES, csv_path: str | None = None):
+        """
+        引数1 enabled：計測するかどうか（Falseならlap()は何もしない）
+        引数2 size：保持するフレーム数
+        引数3 csv_path：フレームごとの計測結果を書き出すCSVファイルのパス
+        """
+        self.enabled = enabled
+        self.size = size
+        self.samples: dict[str, deque] = {}  # 段階名→経過時間[ns]のリングバッファ
+        self.current: dict[str, int] = {}  # 計測中のフレームの段階名→経過時間[ns]
+        self.counts: dict[str, int] = {}  # 直前のフレームのエンティティ数
+        self.last = time.perf_counter_ns()
+        self.frame = 0
+        self.overlay = False  # オーバーレイを表示するか
+        self.overlay_img: pg.Surface | None = None
+        self.csv_file = open(csv_path, "w", newline="") if csv_path else None
+        self.csv_writer = csv.writer(self.csv_file) if self.csv_file is not None else None
+        if self.csv_writer is not None:
+            self.csv_writer.writerow(("frame", "kind", "name", "value"))
+
+    def begin(self):
+        """
+        フレームの計測を始める
+        """
+        self.current = {}
+        self.last = time.perf_counter_ns()
+
+    def lap(self, name: str):
+        """
+        前回のlap()またはbegin()からの経過時間を段階nameに加算する
+        引数 name：段階名
+        """
+        if not self.enabled:
+            return
+        now = time.perf_counter_ns()
+        self.current[name] = self.current.get(name, 0) + now - self.last
+        self.last = now
+
+    def end_frame(self, counts: dict[str, int]):
+        """
+        フレームの計測を終え，結果をリングバッファとCSVに書き出す
+        引数 counts：グループ名→エンティティ数の辞書
+        """
+        if not self.enabled:
+            return
+        self.current["total"] = sum(self.current.values())
+        for name, ns in self.current.items():
+            ring = self.samples.get(name)
+            if ring is None:
+                ring = self.samples[name] = deque(maxlen=self.size)
+            ring.append(ns)
+        self.counts = counts
+        if self.csv_writer is not None:
+            self.csv_writer.writerows((self.frame, "phase", name, ns) for name, ns in self.current.items())
+            self.csv_writer.writerows((self.frame, "count", name, n) for name, n in counts.items())
+        self.frame += 1
+        if self.overlay and self.frame % 25 == 0:
+            self.overlay_img = None  # 0.5秒ごとに表示内容を作り直す
+
+    def percentiles(self, name: str) -> tuple[float, float]:
+        """
+        引数 name：段階名
+        戻り値：保持しているフレームでの経過時間[µs]の50パーセンタイルと99パーセンタイル
+        """
+        p50, p99 = np.percentile(np.fromiter(self.samples[name], dtype=np.int64), (50, 99))
+        return p50/1000, p99/1000
+
+    def summary(self) -> dict[str, tuple[float, float]]:
+        """
+        戻り値：段階名→(50パーセンタイル，99パーセンタイル)[µs]の辞書
+        """
+        return {name: self.percentiles(name) for name in self.samples}
+
+    def draw_overlay(self, screen: pg.Surface) -> list[pg.Rect]:
+        """
+        段階ごとの計測結果とエンティティ数を画面左上に描画する
+        引数 screen：画面Surface
+        戻り値：描画したRectのリスト
+        """
+        if not self.overlay or not self.samples:
+            return []
+        if self.overlay_img is None:
+            font = pg.font.Font(None, 18)
+            lines = [f"{'phase':<18}{'p50[us]':>9}{'p99[us]':>9}"]
+            lines += [f"{name:<18}{p50:>9.0f}{p99:>9.0f}" for name, (p50, p99) in self.summary().items()]
+            lines += [" ".join(f"{name}:{n}" for name, n in self.counts.items())]
+            imgs = [font.render(line, True, (255, 255, 255)) for line in lines]
+            self.overlay_img = pg.Surface((max(img.get_width() for img in imgs)+8, 14*len(imgs)+8))
+            self.overlay_img.set_alpha(192)
+            for i, img in enumerate(imgs):
+                self.overlay_img.blit(img, (4, 4+14*i))
+        return [screen.blit(self.overlay_img, (0, 0))]
+
+    def close(self):
+        """
+        CSVファイルを閉じる
+        """
+        if self.csv_file is not None:
+            self.csv_file.close()
+            self.csv_file = None
+            self.csv_writer = None
+
+
+class GameState:
+    """
+    ゲームの状態を保持し，1フレームずつ進めるクラス
+    画面への描画や表示の更新は行わないので，ウィンドウなしで実時間より速く動かせる
+    """
+    collisions = [  # 衝突判定表（上から順に判定する）
+        Collision("emys", "beams", True, True, "on_emy_shot"),  #ビームと通常敵
+        Collision("bird", "spanners", False, True, "on_spanner"),  #アイテムの取得
+        Collision("bird", "doubles", False, True, "on_double"),
+        Collision("boss", "beams", False, True, "on_armored_shot"),  #ビームと敵
+        Collision("bombs", "beams", True, True, "on_bomb_destroyed"),  # 爆弾はradiusの成分で円として判定される
+        Collision("emy2s", "beams", False, True, "on_armored_shot"),
+        Collision("emys", "gravitys", True, False, "on_emy_crushed"),  #重力場
+        Collision("bombs", "gravitys", True, False, "on_bomb_destroyed"),
+        Collision("bullets", "gravitys", True, False),
+        Collision("bombs", "shields", True, False, "on_bomb_destroyed"),  #防御壁
+        Collision("bullets", "shields", True, False),
+        Collision("bird", "bombs", False, True, "on_bird_bombed"),  #こうかとんと爆弾
+        Collision("bird", "bullets", False, True, "on_bird_shot"),  #こうかとんと弾
+    ]
+
+    groups = (  # エンティティのグループ，Worldの種類，パーティクルの属性名
+        "beams", "emys", "emy2s", "gravitys", "shields", "boss",
+    )+tuple(World.kinds)+("particles",)
+    draw_laps = {name: f"draw.{name}" for name in DRAW_LAYERS}  # 描画対象→グループごとに描画するときの計測の段階名
+
+    waves = (  # 敵の出現処理：(グループ名, 出現させるクラス, レベルから周期を求める関数, 位相)
+        ("emy2s", Enemy2, lambda level: max(100, 1300 - 65*level), 99),  # 1300フレームに1回，強めの敵を出現させる
+        ("emys", Enemy, lambda level: max(10, 200 - 20*level), 0),  # 200フレームに1回，敵機を出現させる
+        ("boss", BOSS, lambda level: max(70, 1000 - 50*level), 69),
+    )
+
+    def __init__(self, seed: int | None = None, profiler: FrameProfiler | None = None,
+                 lifecycle: dict[str, dict] | None = None):
+        """
+        引数1 seed：乱数のシード（Noneなら自動で決める）
+        引数2 profiler：処理段階ごとの計測に使うFrameProfiler（Noneなら計測しない）
+        引数3 lifecycle：グループ名→寿命の規則の辞書（NoneならLIFECYCLE_RULES）
+        """
+        if seed is None:
+            seed = random.randrange(2**32)
+        self.seed = seed
+        self.rng = random.Random(seed)  # ゲーム内で使う乱数生成器（状態ごとに持ち，Snapshotにも含める）
+        self.score = Score("Score", (0, 0, 255), (0, HEIGHT-50))
+
+        #こうかとんと敵に関するグループ/スプライト
+        self.bird = Bird(3, (900, 400))
+        self.life = Score("Life", (255, 0, 0), (0, HEIGHT-100))  # こうかとんの体力表示オブジェクト
+        self.life.value = self.bird.life
+        self.hud = HUD([self.score, self.life])
+        self.beams = pg.sprite.Group()
+        self.emys = pg.sprite.Group()
+        self.emy2s = pg.sprite.Group()
+        self.gravitys = pg.sprite.Group()
+        self.shields = pg.sprite.Group()
+        self.boss = pg.sprite.Group()
+
+        #爆弾，弾，アイテムはWorldの種類ごとのTable（種類名の属性としても参照できる）
+        self.world = World()
+        for kind, table in self.world.tables.items():
+            setattr(self, kind, table)
+        self.particles = ParticleField(seed)  # 爆発などの効果
+        self.btime = 0
+
+        self.grid = SpatialHash()
+        self.prof = profiler if profiler is not None else FrameProfiler(enabled=False)
+        self.batched = BATCHED_DRAW  # まとめて描画するか（Falseならグループごとに描画する）
+        self.queue = RenderQueue()
+        self.lifecycle = Lifecycle(lifecycle if lifecycle is not None else LIFECYCLE_RULES)
+        self.sched = Scheduler()
+        self.tmr = 0
+        self.level = 0  # 得点から決まる敵の出現レベル
+        self.wave_timers: list[Timer | None] = [None]*len(self.waves)
+        self.schedule_waves()
+        self.damaged = False  # このフレームでこうかとんが被弾したか
+        self.overlays = OverlayStack()
+        self.quality = QUALITY_STEPS[0]  # 現在の品質の段階の設定
+        self.prev: dict[pg.sprite.Sprite, tuple[int, int]] = {}  # remember()で覚えたスプライト→左上座標
+        self.over = False  # ゲームオーバーになったか
+        if HUD_DEBUG:
+            self.hud.add(Score("Beam", (0, 128, 0), (0, HEIGHT-150), lambda: self.btime))
+            self.hud.add(Score("Level", (128, 0, 128), (0, HEIGHT-200), lambda: self.level))
+
+    def step(self, inputs: Inputs):
+        """
+        入力に応じてゲームを1フレーム進める
+        引数 inputs：このフレームの入力
+        """
+        bird, score, prof = self.bird, self.score, self.prof
+        self.damaged = False
+        if self.over:
+            return
+        self.overlays.update()
+
+        #こうかとんの操作に関する処理
+        mode = 0
+        if inputs[pg.K_LSHIFT]:
+            mode = 1
+        #ビーム
+        if pg.K_SPACE in inputs.pressed:
+            if self.btime > 0:
+                if not mode:
+                    self.beams.add(Beam.new(bird, a=4))
+                else:
+                    self.beams.add(*NeoBeam(bird, 7, b=4).gen_beams())
+                self.btime -= 1
+            else:
+                if not mode:
+                    self.beams.add(Beam.new(bird))
+                else:
+                    self.beams.add(*NeoBeam(bird, 7, b=2).gen_beams())
+        #EMP
+        if pg.K_e in inputs.pressed:
+            if score.value > 20:
+                EMP(self.emys, self.bombs)
+                score.value -= 20
+        #重力場
+        if pg.K_RETURN in inputs.pressed:
+            if score.value >= 200:
+                score.value -= 200
+                gravity = Gravity(50)
+                self.gravitys.add(gravity)
+                self.sched.at(self.tmr+gravity.life-1, "update", gravity.kill)
+        #防御壁
+        if pg.K_v in inputs.pressed:
+            if score.value >= 50 and len(self.shields) == 0:
+                score.value -= 50
+                shield = Shield(bird, 400)
+                self.shields.add(shield)
+                self.sched.at(self.tmr+shield.life, "update", shield.kill)
+        prof.lap("actions")
+
+        #敵の出現処理（レベルが変わったら出現周期を予約し直す）
         level = int(math.log10(score.value+1))
-        if tmr%(max(100, 1300 - 65*level)) == 99: # 1300フレームに1回，強めの敵を出現させる
-            emy2s.add(Enemy2())
-        if tmr%(max(10, 200 - 20*level)) == 0:  # 200フレームに1回，敵機を出現させる
-            emys.add(Enemy())
-        if tmr%(max(70, 1000 - 50*level)) == 69:
-            boss.add(BOSS())
+        if level != self.level:
+            self.level = level
+            self.schedule_waves()
+        self.sched.run(self.tmr, "spawn")
+        prof.lap("spawn")
 
         #爆弾の生成
-        for emy in emys:
-            if emy.state == "stop" and tmr%emy.interval == 0:
-                # 敵機が停止状態に入ったら，intervalに応じて爆弾投下
-                bombs.add(Bomb(emy, bird, score))
-        for bos in boss:
-            if bos.state == "stop" and tmr%bos.interval == 0:
-                bombs.add(Bomb(bos, bird, score))
-
-        #ビームと通常敵に関する処理
-        for emy in pg.sprite.groupcollide(emys, beams, True, True).keys():
-            exps.add(Explosion(emy, 100))  # 爆発エフェクト
-            score.value += 10  # 10点アップ
-            bird.change_img(6, screen)  # こうかとん喜びエフェクト
-            rand = random.randint(1,2)  #4分の1の確率でアイテム生成
-            if rand == 1:
-                spanners.add(Spanner(emy))
-            elif rand == 2:
-                doubles.add(Double(emy))
-
-        #アイテムの取得に関する処理
-        for spanner in pg.sprite.spritecollide(bird, spanners, True):
-            btime = 10
-            bird.change_img(6, screen)  # こうかとん喜びエフェクト
-            if event.type == pg.KEYDOWN and event.key == pg.K_SPACE:    
-                neobeam = NeoBeam(bird, 7)
-                for beam in neobeam.gen_beams():
-                    beams.add(beam)
-        for double in pg.sprite.spritecollide(bird, doubles, True):
-            bird.change_img(6, screen)   # こうかとん喜びエフェクト
-            score.value *= 2  # 2倍点アップ          
-        
-        #ビームと敵の接触の処理
-        for bos in pg.sprite.groupcollide(boss, beams, False, True):
-            bos.life -= 1
-            score.value += 5
-            if bos.life < 0:
-                bos.kill()
-                exps.add(Explosion(bos, 200))
-                score.value += 200
-        for bomb in pg.sprite.groupcollide(bombs, beams, True, True).keys():
-            exps.add(Explosion(bomb, 50))  # 爆発エフェクト
-            score.value += 1  # 1点アップ
-        for emy2 in pg.sprite.groupcollide(emy2s, beams, False, True):
-            emy2.life -= 1
-            score.value += 5
-            if emy2.life < 0:
-                emy2.kill()
-                exps.add(Explosion(emy2, 200))
-                score.value += 200
-        
-        #重力場に関する処理
-        for emy in pg.sprite.groupcollide(emys, gravitys, True, False).keys():
-            exps.add(Explosion(emy, 50))
-            score.value += 10
-        for bomb in pg.sprite.groupcollide(bombs, gravitys, True, False).keys():
-            exps.add(Explosion(bomb, 50))
-            score.value += 1
-        for bullet in pg.sprite.groupcollide(bullets, gravitys, True, False):
-            pass
-        
-        #防御壁に関する処理
-        for bomb in pg.sprite.groupcollide(bombs, shields, True, False).keys():
-            exps.add(Explosion(bomb, 50))
-            score.value += 1
-        for bullet in pg.sprite.groupcollide(bullets, shields, True, False):
-            pass
-        
-        #こうかとんと爆弾についての処理
-        for bomb in pg.sprite.spritecollide(bird, bombs, True):
-            if bomb.state == "inactive":
+        self.sched.run(self.tmr, "drop")
+        prof.lap("bomb_drop")
+
+        self.collide(inputs)
+        prof.lap("collide")
+        if self.over:
+            return
+
+        bird.update(inputs, score)
+        prof.lap("update.bird")
+        self.beams.update()
+        prof.lap("update.beams")
+        self.emys.update(self.on_emy_stop)
+        prof.lap("update.emys")
+        self.boss.update(self.on_boss_stop)
+        prof.lap("update.boss")
+        self.sched.run(self.tmr, "update")  # 敵2とボスの弾幕，重力場と防御壁の寿命
+        prof.lap("timers")
+        self.emy2s.update(self.arm)
+        prof.lap("update.emy2s")
+        self.world.update(prof)
+        self.particles.update()
+        prof.lap("update.particles")
+        self.lifecycle.update(self)
+        prof.lap("lifecycle")
+        #画面に重ねる効果
+        if self.gravitys:
+            self.overlays["gravity"].show()
+        else:
+            self.overlays["gravity"].hide()
+        if bird.state == "hyper":
+            self.overlays["hyper"].show()
+        else:
+            self.overlays["hyper"].hide()
+        self.tmr += 1
+
+    def schedule_waves(self):
+        """
+        現在のレベルでの周期に従って，敵の出現を次に条件を満たすフレームに予約し直す
+        """
+        for i, (name, cls, period, offset) in enumerate(self.waves):
+            if self.wave_timers[i] is not None:
+                self.wave_timers[i].cancel()
+            tick = self.tmr+(offset-self.tmr) % period(self.level)
+            self.wave_timers[i] = self.sched.at(tick, "spawn", self.spawn_wave, i)
+
+    def spawn_wave(self, i: int):
+        """
+        敵を出現させ，次の出現を予約する
+        引数 i：wavesの番号
+        """
+        name, cls, period, offset = self.waves[i]
+        getattr(self, name).add(cls(self.rng))
+        self.wave_timers[i] = self.sched.at(self.tmr+period(self.level), "spawn", self.spawn_wave, i)
+
+    def on_emy_stop(self, emy: "Enemy|BOSS"):
+        """
+        敵機が停止状態に入ったら，intervalで割り切れる次のフレームから爆弾投下を予約する
+        引数 emy：停止した敵機
+        """
+        if math.isinf(emy.interval):  # EMPで無力化されている
+            return
+        tick = self.tmr+1
+        self.sched.at(tick+(-tick) % emy.interval, "drop", self.drop_bomb, emy)
+
+    def drop_bomb(self, emy: "Enemy|BOSS"):
+        """
+        爆弾を投下し，intervalフレーム後の投下を予約する
+        引数 emy：爆弾を投下する敵機
+        """
+        if not emy.alive() or math.isinf(emy.interval):
+            return
+        Bomb.spawn(self.bombs, emy, self.bird, self.score, self.rng)
+        self.sched.at(self.tmr+emy.interval, "drop", self.drop_bomb, emy)
+
+    def on_boss_stop(self, boss: BOSS):
+        """
+        ボスが停止状態に入ったら，爆弾投下に加えて弾幕の発射を予約する
+        引数 boss：停止したボス
+        """
+        self.on_emy_stop(boss)
+        self.arm(boss)
+
+    def arm(self, shooter: "Enemy2|BOSS"):
+        """
+        敵が攻撃を始めたら，次のフレームを起点にattacksの各パターンの発射を予約する
+        引数 shooter：攻撃を始めた敵2またはボス
+        """
+        start = self.tmr+1
+        for period, offset, name in shooter.attacks:
+            self.sched.at(start+offset, "update", self.fire, shooter, period, PATTERNS[name], 0)
+
+    def fire(self, shooter: "Enemy2|BOSS", period: int, pattern: BulletPattern, k: int):
+        """
+        弾幕パターンを撃たせ，period後の次の発射を予約する
+        引数4 k：このパターンを撃った回数
+        """
+        if not shooter.alive():
+            return
+        pattern.fire(shooter.rect.center, self.bullets, self.bird, self.rng, k)
+        self.sched.at(self.tmr+period, "update", self.fire, shooter, period, pattern, k+1)
+
+    def explode(self, obj: "pg.sprite.Sprite|Entity", life: int, debris: int = 0):
+        """
+        爆発エフェクトを出す
+        引数1 obj：爆発するスプライトまたはエンティティ
+        引数2 life：爆発時間
+        引数3 debris：飛び散る破片の数
+        """
+        self.particles.emit("explosion", obj.rect.center, life=life)
+        if debris:
+            self.particles.emit("debris", obj.rect.center, debris)
+
+    def set_quality(self, quality: dict):
+        """
+        品質の段階の設定を切り替える（見た目だけを変え，ゲームの進行には影響しない）
+        引数 quality：QUALITY_STEPSの要素
+        """
+        self.quality = quality
+        self.particles.cap = min(self.particles.capacity, quality.get("particle_cap", self.particles.capacity))
+        self.particles.life_scale = quality.get("particle_life", 1.0)
+        self.bullets.quantum = max(1, self.bullets.steps//quality.get("bullet_steps", self.bullets.steps))
+
+    def counts(self) -> dict[str, int]:
+        """
+        戻り値：グループ名→エンティティ数の辞書
+        """
+        return {name: len(getattr(self, name)) for name in self.groups}
+
+    def collide(self, inputs: Inputs):
+        """
+        衝突判定表に従って衝突を判定し，対応する処理を呼び出す
+        ゲームオーバーになったらその時点で打ち切る
+        引数 inputs：このフレームの入力
+        """
+        self.inputs = inputs
+        self.grid.build([
+            group for group in (getattr(self, name) for name in dict.fromkeys(c.b for c in self.collisions))
+            if isinstance(group, pg.sprite.AbstractGroup)
+        ])
+        for c in self.collisions:
+            groupa = self.bird if c.a == "bird" else getattr(self, c.a)
+            groupb = getattr(self, c.b)
+            if isinstance(groupb, Table):  # Worldのエンティティは種類ごとにまとめて判定する
+                hits = groupb.spritecollide(groupa, c.kill_b)
+                crashed = {groupa: hits} if hits else {}
+            elif isinstance(groupa, Table):
+                crashed = groupa.groupcollide(groupb, c.kill_a, c.kill_b)
+            elif c.a == "bird":
+                hits = self.grid.spritecollide(groupa, groupb, c.kill_b)
+                crashed = {groupa: hits} if hits else {}
+            else:
+                crashed = self.grid.groupcollide(groupa, groupb, c.kill_a, c.kill_b)
+            if c.handler is None:
+                continue
+            handler = getattr(self, c.handler)
+            for a, hits in crashed.items():
+                handler(a, hits)
+                if self.over:
+                    return
+
+    def spawn(self, group: pg.sprite.AbstractGroup, sprite: pg.sprite.Sprite):
+        """
+        スプライトをグループに加え，衝突判定用のグリッドにも登録する
+        引数1 group：追加先のグループ
+        引数2 sprite：追加するスプライト
+        """
+        group.add(sprite)
+        self.grid.insert(sprite, group)
+
+    def on_emy_shot(self, emy: Enemy, beams: list[Beam]):
+        self.explode(emy, 100, debris=6)  # 爆発エフェクト
+        self.score.value += 10  # 10点アップ
+        self.bird.change_img(6)  # こうかとん喜びエフェクト
+        rand = self.rng.randint(1,2)  #4分の1の確率でアイテム生成
+        if rand == 1:
+            Spanner.spawn(self.spanners, emy)
+        elif rand == 2:
+            Double.spawn(self.doubles, emy)
+
+    def on_spanner(self, bird: Bird, spanners: list[Entity]):
+        for spanner in spanners:
+            self.particles.emit("pickup", spanner.rect.center)
+            self.btime = 10
+            bird.change_img(6)  # こうかとん喜びエフェクト
+            if pg.K_SPACE in self.inputs.pressed:
+                for beam in NeoBeam(bird, 7, b=4).gen_beams():
+                    self.spawn(self.beams, beam)
+
+    def on_double(self, bird: Bird, doubles: list[Entity]):
+        for double in doubles:
+            self.particles.emit("pickup", double.rect.center)
+            bird.change_img(6)   # こうかとん喜びエフェクト
+            self.score.value *= 2  # 2倍点アップ
+
+    def on_armored_shot(self, emy: "BOSS|Enemy2", beams: list[Beam]):
+        for beam in beams:
+            self.particles.emit("spark", beam.rect.center, 4)  # 装甲に弾かれる火花
+        emy.life -= 1
+        self.score.value += 5
+        if emy.life < 0:
+            emy.kill()
+            self.explode(emy, 200, debris=12)
+            self.score.value += 200
+
+    def on_bomb_destroyed(self, bomb: Entity, hits: list):
+        self.explode(bomb, 50)  # 爆発エフェクト
+        self.particles.emit("spark", bomb.rect.center, 6)
+        self.score.value += 1  # 1点アップ
+
+    def on_emy_crushed(self, emy: Enemy, gravitys: list[Gravity]):
+        self.explode(emy, 50, debris=6)
+        self.score.value += 10
+
+    def on_bird_bombed(self, bird: Bird, bombs: list[Entity]):
+        for bomb in bombs:
+            if not bomb.active:
                 continue
             if bird.state == "hyper":  # こうかとんが無敵状態のとき
-                exps.add(Explosion(bomb, 50))  # 爆発エフェクト
-                score.value += 1
+                self.explode(bomb, 50)  # 爆発エフェクト
+                self.score.value += 1
             elif bird.state == "normal":  # こうかとんが通常状態のとき
-                bird.life -= 1  # 体力を1減らす
-                life.value = bird.life # 体力の更新
-                exps.add(Explosion(bomb, 50))  # 爆発エフェクト
-                red = pg.Surface((WIDTH, HEIGHT))
-                pg.draw.rect(red, (255, 0, 0), (0, 0, WIDTH, HEIGHT))
-                red.set_alpha(64)
-                screen.blit(red,(0,0))
-                pg.display.update()
-            if bird.life <= 0:  # こうかとんの体力が0以下になったとき
-                bird.change_img(8, screen) # こうかとん悲しみエフェクト
-                score.update(screen)
-                life.update(screen)
-                pg.display.update()
-                time.sleep(2)
+                self.explode(bomb, 50)  # 爆発エフェクト
+                self.hurt()
+            if self.over:
                 return
-        
-        #こうかとんと弾に関する処理
-        for bullet in pg.sprite.spritecollide(bird, bullets, True):
-            if bird.state == "hyper":  # こうかとんが無敵状態のとき
-                pass
-            elif bird.state == "normal":  # こうかとんが通常状態のとき
-                bird.life -= 1  # 体力を1減らす
-                life.value = bird.life # 体力の更新
-                red = pg.Surface((WIDTH, HEIGHT))
-                pg.draw.rect(red, (255, 0, 0), (0, 0, WIDTH, HEIGHT))
-                red.set_alpha(64)
-                screen.blit(red,(0,0))
-                pg.display.update()
-            if bird.life <= 0:  # こうかとんの体力が0以下になったとき
-                bird.change_img(8, screen) # こうかとん悲しみエフェクト
-                score.update(screen)
-                life.update(screen)
+
+    def on_bird_shot(self, bird: Bird, bullets: list[Entity]):
+        for bullet in bullets:
+            if bird.state == "normal":  # こうかとんが通常状態のとき
+                self.hurt()
+            if self.over:
+                return
+
+    def hurt(self):
+        """
+        こうかとんの体力を1減らし，0以下になったらゲームオーバーにする
+        """
+        self.bird.life -= 1  # 体力を1減らす
+        self.life.value = self.bird.life # 体力の更新
+        self.damaged = True
+        self.overlays["damage"].flash()
+        self.bird.flash(10)  # 10フレームの間こうかとんを赤くする
+        if self.bird.life <= 0:  # こうかとんの体力が0以下になったとき
+            self.bird.change_img(8) # こうかとん悲しみエフェクト
+            self.over = True
+
+    def snapshot(self) -> bytes:
+        """
+        戻り値：現在の状態をまとめたバイト列（restore()で戻せる）
+        """
+        return Snapshot.capture(self)
+
+    def restore(self, data: bytes):
+        """
+        snapshot()で撮った状態に戻す
+        引数 data：snapshot()の戻り値
+        """
+        Snapshot.restore(self, data)
+
+    def remember(self):
+        """
+        step()の前に呼び，スプライトの位置を覚えておく（描画で前後の状態の間を補間するため）
+        """
+        self.prev = {
+            sprite: sprite.rect.topleft
+            for group in (getattr(self, name) for name in self.groups)
+            if isinstance(group, pg.sprite.AbstractGroup) for sprite in group
+        }
+        self.prev[self.bird] = self.bird.rect.topleft
+        self.world.remember()
+
+    def draw(self, screen: pg.Surface, background: bool = True, doreturn: bool = True,
+             alpha: float = 1.0) -> list[pg.Rect]:
+        """
+        現在の状態を画面Surfaceに描画する（表示の更新は呼び出し側で行う）
+        batchedが真ならRenderQueueにまとめて描画し，偽ならDRAW_LAYERSの順にグループごとに描画する
+        引数1 screen：画面Surface
+        引数2 background：背景も描画するかどうか
+        引数3 doreturn：描画したRectのリストを返すかどうか
+        引数4 alpha：remember()した位置と現在の位置の間のどこに描くか（1なら現在の位置）
+        戻り値：スプライト，HUD，Overlayを描画したRectのリスト（doreturnが偽なら空のリスト）
+        """
+        prof = self.prof
+        if background:
+            screen.blit(ASSETS.load("fig/pg_bg.jpg"), [0, 0])
+            prof.lap("draw.background")
+        skip = self.quality.get("skip", ())
+        if self.batched:
+            for name, layer in DRAW_LAYERS.items():
+                if name not in skip:
+                    self.queue.extend(layer, self.draw_items(name, alpha))
+            prof.lap("draw.queue")
+            rects = self.queue.flush(screen, doreturn)
+            prof.lap("draw.blits")
+        else:
+            rects = []
+            for name in sorted(DRAW_LAYERS, key=DRAW_LAYERS.get):
+                if name not in skip:
+                    rects += screen.blits(self.draw_items(name, alpha), doreturn=doreturn) or []
+                prof.lap(self.draw_laps[name])
+        overlays = self.overlays.draw(screen, skip)  # 最後に画面全体の効果を重ねる
+        if doreturn:
+            rects += overlays
+        prof.lap("draw.overlays")
+        return rects
+
+    def draw_items(self, name: str, alpha: float = 1.0):
+        """
+        描画対象の(画像Surface, 位置)を返す
+        引数1 name：DRAW_LAYERSの描画対象名
+        引数2 alpha：補間の割合（1なら現在の位置）
+        戻り値：(画像Surface, 位置)のイテラブル
+        """
+        if name == "hud":
+            self.hud.update()
+            return ((self.hud.image, self.hud.rect),)
+        if name in self.world.tables:
+            return self.world[name].items(alpha)
+        if name == "particles":
+            return self.particles.items(alpha)
+        sprites = (self.bird,) if name == "bird" else getattr(self, name)
+        if alpha >= 1 or not self.prev:
+            return [(sprite.image, sprite.rect) for sprite in sprites]
+        return [(sprite.image, self.lerp(sprite, alpha)) for sprite in sprites]
+
+    def lerp(self, sprite: pg.sprite.Sprite, alpha: float) -> tuple[float, float] | pg.Rect:
+        """
+        引数1 sprite：スプライト
+        引数2 alpha：補間の割合
+        戻り値：remember()した位置と現在の位置の間の左上座標（覚えていなければ現在のRect）
+        """
+        prev = self.prev.get(sprite)
+        if prev is None:  # remember()の後に出現した
+            return sprite.rect
+        x, y = sprite.rect.topleft
+        return prev[0]+(x-prev[0])*alpha, prev[1]+(y-prev[1])*alpha
+
+
+class RenderQueue:
+    """
+    1フレーム分の描画要求を集めてまとめて描画するクラス
+    レイヤーの小さい順に，同じレイヤーの中は元画像ごとにまとめて，レイヤーごとに1回のblitsで描画する
+    """
+    def __init__(self):
+        self.layers: dict[int, dict[pg.Surface, list]] = {}  # レイヤー番号→元画像→位置のリスト
+
+    def __len__(self) -> int:
+        return sum(len(poss) for batch in self.layers.values() for poss in batch.values())
+
+    def extend(self, layer: int, items):
+        """
+        描画要求をまとめて追加する
+        引数1 layer：レイヤー番号
+        引数2 items：(画像Surface, 位置)のイテラブル
+        """
+        batch = self.layers.get(layer)
+        if batch is None:
+            batch = self.layers[layer] = {}
+        for image, pos in items:
+            poss = batch.get(image)
+            if poss is None:
+                batch[image] = [pos]
+            else:
+                poss.append(pos)
+
+    def flush(self, screen: pg.Surface, doreturn: bool = False) -> list[pg.Rect]:
+        """
+        集めた描画要求を描画して空にする
+        引数1 screen：描画先Surface
+        引数2 doreturn：描画したRectのリストを返すかどうか
+        戻り値：描画したRectのリスト（doreturnが偽なら空のリスト）
+        """
+        rects = []
+        for layer in sorted(self.layers):
+            batch = self.layers[layer]
+            blits = [(image, pos) for image, poss in batch.items() for pos in poss]
+            if doreturn:
+                rects += screen.blits(blits)
+            else:
+                screen.blits(blits, doreturn=False)
+        self.layers.clear()
+        return rects
+
+
+class QualityGovernor:
+    """
+    1フレームの処理時間の移動平均を見て，品質の段階を上げ下げするクラス
+    目標を超えたら1段階軽くし，十分に下回ったら1段階戻す．変更はすべてlogに残し標準エラーに出力する
+    """
+    def __init__(self, budget: float = QUALITY_BUDGET, window: int = QUALITY_WINDOW,
+                 restore: float = QUALITY_RESTORE, steps: tuple[dict, ...] = QUALITY_STEPS):
+        """
+        引数1 budget：1フレームの処理時間の目標[ms]
+        引数2 window：移動平均をとるフレーム数
+        引数3 restore：品質を戻す処理時間の目標に対する割合
+        引数4 steps：品質の段階の設定のタプル
+        """
+        self.budget = budget
+        self.restore = restore
+        self.steps = steps
+        self.times: deque = deque(maxlen=window)  # 直近のフレームの処理時間[ms]
+        self.level = 0  # 現在の品質の段階（0が最高品質）
+        self.log: list[tuple[int, int, int, float]] = []  # (フレーム，変更前の段階，変更後の段階，移動平均[ms])
+
+    def update(self, frame_ms: float, state: GameState):
+        """
+        フレームの処理時間を記録し，必要なら品質の段階を変える
+        引数1 frame_ms：このフレームの処理時間[ms]
+        引数2 state：品質を切り替えるGameState
+        """
+        self.times.append(frame_ms)
+        if len(self.times) < self.times.maxlen:
+            return
+        mean = sum(self.times)/len(self.times)
+        if mean > self.budget and self.level < len(self.steps)-1:
+            self.change(self.level+1, mean, state)
+        elif mean < self.budget*self.restore and self.level > 0:
+            self.change(self.level-1, mean, state)
+
+    def change(self, level: int, mean: float, state: GameState):
+        """
+        品質の段階を変えて記録する
+        引数1 level：新しい段階
+        引数2 mean：判断に使った移動平均[ms]
+        引数3 state：品質を切り替えるGameState
+        """
+        self.log.append((state.tmr, self.level, level, mean))
+        print(f"quality {self.level} -> {level} at tick {state.tmr} (frame {mean:.1f} ms)", file=sys.stderr)
+        self.level = level
+        state.set_quality(self.steps[level])
+        self.times.clear()  # 変更の効果が出るまで次の判断を待つ
+
+
+class DirtyRenderer:
+    """
+    前のフレームから変化した部分だけを描き直して表示するクラス
+    前フレームで描いた範囲を背景で塗り戻してからスプライトを描き，
+    前フレームと今フレームの範囲だけを表示に反映する
+    """
+    def __init__(self, background: pg.Surface, threshold: float = DIRTY_THRESHOLD):
+        """
+        引数1 background：背景画像Surface
+        引数2 threshold：全体を描き直す面積の割合
+        """
+        self.background = background
+        self.threshold = threshold*WIDTH*HEIGHT
+        self.prev: list[pg.Rect] = []  # 前フレームで描画したRect
+        self.full = True  # 次のフレームを全体描き直しにするか
+        self.dirty_pixels = 0  # 直前のフレームで描き直した画素数
+        self.full_frames = 0  # 全体を描き直したフレーム数
+
+    def render(self, state: GameState, screen: pg.Surface, overlay=None, alpha: float = 1.0):
+        """
+        状態を描画して表示を更新する
+        引数1 state：描画するGameState
+        引数2 screen：画面Surface
+        引数3 overlay：最前面に描画してRectのリストを返す関数（Noneなら描画しない）
+        引数4 alpha：GameState.draw()に渡す補間の割合
+        """
+        full = self.full or state.overlays.visible()
+        if not full:
+            for rect in self.prev:
+                screen.blit(self.background, rect, rect)
+        rects = state.draw(screen, background=full, alpha=alpha)
+        if overlay is not None:
+            rects += overlay(screen)
+        screen_rect = screen.get_rect()
+        dirty = [rect.clip(screen_rect) for rect in self.prev+rects]
+        area = sum(rect.w*rect.h for rect in dirty)
+        self.dirty_pixels = WIDTH*HEIGHT if full else area
+        if full or area > self.threshold:
+            pg.display.update()
+            self.full_frames += 1
+        else:
+            pg.display.update(dirty)
+        self.prev = rects
+        # 画面全体の効果を重ねたフレームの次や，描き直す範囲が広いときは全体を描き直す
+        self.full = state.overlays.visible() or area > self.threshold
+
+
+def bake_assets(bundle: bool = True):
+    """
+    起動時にバンドルを開き，回転アトラスと効果をかけた画像を用意する
+    バンドルがあれば画像は初めて使うときにそこから取り出し，なければここで生成する
+    引数 bundle：バンドルを使うかどうか
+    """
+    if bundle:
+        ASSETS.open_bundle()
+    ASSETS.bake_atlas("fig/rocket.png", (1.0,))
+    ASSETS.bake_atlas("fig/beam.png", (2.0, 4.0, 6.0))
+    Bomb.images()  # すべての半径と色の爆弾円
+    if ASSETS.bundle is None:
+        for effect in EFFECTS:
+            for path in Enemy.imgs:
+                ASSETS.get(path, effect=effect)
+            for num in (6, 8):  # 喜び・悲しみのこうかとん
+                ASSETS.get(f"fig/{num}.png", 0, 2.0, effect=effect)
+
+
+def bake_bundle(path: str = ASSET_BUNDLE):
+    """
+    fig/の画像と，ゲームで使う拡大・回転・効果済みの画像をピクセルデータのまま1つのバンドルにまとめる
+    引数 path：書き出すバンドルのパス
+    """
+    pg.display.set_mode((1, 1), pg.HIDDEN)  # 画面と同じピクセル形式に変換するため
+    bake_assets(bundle=False)
+    state = GameState(0)  # こうかとんの向き・効果ごとの画像
+    for sprite in (BOSS(state.rng), Enemy2(state.rng)):
+        sprite.kill()
+    for table in state.world.tables.values():
+        table.load()
+    for name in sorted(os.listdir(os.path.join(ROOT, "fig"))):
+        ASSETS.load(f"fig/{name}")
+    ASSETS.save_bundle(path)
+
+
+def run_headless(ticks: int, seed: int | None = None, policy=None, state: GameState | None = None,
+                 observe=None) -> GameState:
+    """
+    ウィンドウを使わず，実時間に合わせずにゲームを進める
+    引数1 ticks：進める最大フレーム数
+    引数2 seed：乱数のシード（stateを渡したときは使わない）
+    引数3 policy：GameStateを受け取りInputsを返す関数（Noneなら無操作）
+    引数4 state：進めるGameState（Noneならseedから作る）
+    引数5 observe：1フレーム進めるたびにGameStateとstep()にかかった時間[s]を受け取る関数
+    戻り値：最後のGameState
+    """
+    if state is None:
+        state = GameState(seed)
+    idle = Inputs()
+    clock = time.perf_counter
+    for _ in range(ticks):
+        inputs = policy(state) if policy is not None else idle
+        start = clock()
+        state.step(inputs)
+        if observe is not None:
+            observe(state, clock()-start)
+        if state.over:
+            break
+    return state
+
+
+def run_replay(log: InputLog, profiler: FrameProfiler | None = None) -> GameState:
+    """
+    リプレイの入力でウィンドウを使わず，実時間に合わせずにゲームを進める
+    引数1 log：再生するInputLog
+    引数2 profiler：処理段階ごとの計測に使うFrameProfiler（Noneなら計測しない）
+    戻り値：最後のGameState
+    """
+    state = GameState(log.seed, profiler)
+    for inputs in log.inputs():
+        if profiler is not None:
+            profiler.begin()
+        state.step(inputs)
+        if profiler is not None:
+            profiler.end_frame(state.counts())
+        if state.over:
+            break
+    return state
+
+
+def main():
+    pg.display.set_caption("真！こうかとん無双")
+    screen = pg.display.set_mode((WIDTH, HEIGHT))
+    bake_assets()
+    prof = FrameProfiler(csv_path=PROFILE_CSV)
+    state = GameState(profiler=prof)
+    log = InputLog(state.seed) if REPLAY_LOG is not None else None
+    rewind = Rewind() if REWIND_FRAMES > 0 else None
+    renderer = DirtyRenderer(ASSETS.load("fig/pg_bg.jpg")) if DIRTY_RENDERING else None
+    governor = QualityGovernor() if QUALITY_GOVERNOR else None
+    clock = pg.time.Clock()
+    if HUD_DEBUG:
+        state.hud.add(Score("FPS", (0, 0, 0), (0, HEIGHT-250), lambda: round(clock.get_fps())))
+    dt = 1/SIM_HZ  # 1回の進行が表す時間[s]
+    lag = 0.0  # まだ進めていない時間[s]
+    pressed = set()  # まだstep()に渡していない新たな押下
+    sim_ticks = render_frames = 0
+    last = time.perf_counter()
+
+    try:
+        while True:
+            start = time.perf_counter()
+            lag = min(lag+start-last, MAX_FRAMESKIP*dt)
+            last = start
+            prof.begin()
+            inputs = Inputs.from_pygame((PROFILE_KEY, REWIND_KEY))
+            prof.lap("input")
+            if inputs.quit:
+                return 0
+            if PROFILE_KEY in inputs.pressed:
+                prof.overlay = not prof.overlay
+                prof.overlay_img = None
+            if REWIND_KEY in inputs.pressed and rewind is not None:
+                rewind.rewind(state, REWIND_STEP)
+                if log is not None:
+                    del log.frames[state.tmr:]  # 巻き戻した後の入力を記録し直す
+            pressed.update(inputs.pressed)
+
+            # 溜まった時間の分だけ一定間隔で進める（遅れているときは描画を省いて続けて進める）
+            ticks = 0
+            while lag >= dt and not state.over:
+                tick_inputs = Inputs(inputs.held, pressed)
+                pressed.clear()
+                state.remember()
+                if rewind is not None:
+                    rewind.push(state, tick_inputs)
+                    prof.lap("rewind")
+                state.step(tick_inputs)
+                if log is not None:
+                    log.record(tick_inputs)
+                lag -= dt
+                ticks += 1
+            sim_ticks += ticks
+
+            # 前回と今回の進行の間を補間して描画する
+            alpha = 1.0 if state.over else lag/dt
+            if renderer is not None:
+                renderer.render(state, screen, prof.draw_overlay, alpha)
+            else:
+                state.draw(screen, doreturn=False, alpha=alpha)
+                prof.draw_overlay(screen)
                 pg.display.update()
+            render_frames += 1
+            prof.lap("present")
+            counts = state.counts()
+            counts["ticks"] = ticks  # このフレームで進めた回数（計測結果のCSVとオーバーレイにも出す）
+            if renderer is not None:
+                counts["dirty_pixels"] = renderer.dirty_pixels  # 描き直した画素数と全体を描き直したフレーム数
+                counts["full_frames"] = renderer.full_frames
+            if governor is not None:
+                governor.update((time.perf_counter()-start)*1000, state)
+                counts["quality"] = governor.level
+            prof.end_frame(counts)
+            if state.over:
                 time.sleep(2)
                 return
-        
-        bird.update(key_lst, screen, score)
-        beams.update()
-        beams.draw(screen)
-        emys.update()
-        emys.draw(screen)
-        boss.update()
-        boss.draw(screen)
-        emy2s.update(bullets, bird)
-        emy2s.draw(screen)
-        bullets.update()
-        bullets.draw(screen)
-        bombs.update()
-        bombs.draw(screen)
-        shields.update()
-        shields.draw(screen)
-        exps.update()
-        exps.draw(screen)
-        gravitys.update()
-        gravitys.draw(screen)
-        score.update(screen)
-        spanners.update()
-        spanners.draw(screen)
-        doubles.update()
-        doubles.draw(screen)
-        life.update(screen)
-        pg.display.update()
-        tmr += 1
-        clock.tick(50)
+            clock.tick(RENDER_FPS)
+    except Exception:
+        if rewind is not None and CRASH_DUMP is not None:
+            path = os.path.join(ROOT, CRASH_DUMP)
+            rewind.save(path)  # Rewind.load()で読み込めば，止まったフレームまでの好きなフレームから進め直せる
+            print(f"直前{len(rewind)}フレーム分の状態を{path}に書き出しました", file=sys.stderr)
+        raise
+    finally:
+        prof.close()
+        if log is not None:
+            log.finish(state)
+            log.save(REPLAY_LOG)
+        if render_frames:
+            print(f"sim/render: {sim_ticks} ticks / {render_frames} frames = {sim_ticks/render_frames:.2f}", file=sys.stderr)
+        for name, r in state.lifecycle.report().items():  # グループごとの数の傾きと規則で消した数
+            leaking = "  leaking" if r["leaking"] else ""
+            print(f"lifecycle {name}: {r['count']} ({r['slope_per_1000']:+.1f}/1000 ticks, removed {r['removed']}){leaking}",
+                  file=sys.stderr)
 
 
 if __name__ == "__main__":
     pg.init()
-    main()
+    if sys.argv[1:] == ["--bake"]:
+        bake_bundle()
+    else:
+        main()
     print()
     pg.quit()
-    sys.exit()
\ No newline at end of file
+    sys.exit()